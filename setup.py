@@ -10,7 +10,7 @@ from setuptools import setup
 
 
 name = 'flake8-ownership'
-version = '2.0.2'
+version = '2.1.0'
 requires = (
     'flake8>=3,<4',
 )
@@ -40,6 +40,9 @@ setup(
     ],
     description=description,
     entry_points={
+        'console_scripts': [
+            '%s = %s_cli:main' % (name, name.replace('-', '_')),
+        ],
         'flake8.extension': [
             'O10 = %s:Checker' % name.replace('-', '_'),
         ],
@@ -49,7 +52,10 @@ setup(
     long_description=long_description,
     name=name,
     package_dir={'': 'src'},
-    py_modules=[name.replace('-', '_')],
+    py_modules=[
+        name.replace('-', '_'),
+        '%s_cli' % name.replace('-', '_'),
+    ],
     url=url,
     version=version,
     zip_safe=False,
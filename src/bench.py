@@ -0,0 +1,568 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks for flake8-ownership.
+
+:author: Joe Joyce <joe@decafjoe.com>
+:copyright: Copyright (c) Joe Joyce and contributors, 2016-2019.
+:license: BSD
+
+Each scenario generates a synthetic corpus, then checks it in each mode:
+
+``direct``
+  :meth:`~flake8_ownership.Checker.parse_options` and
+  :meth:`~flake8_ownership.Checker.run` in-process, with the lines read up
+  front (which is what flake8 does). The best of three runs is reported.
+``file``
+  Same as ``direct``, but the checker reads the files itself.
+``reopen``
+  Same as ``direct``, but each file is read again, line by line, as the
+  checker did before it used the lines flake8 hands over.
+``flake8``
+  A ``flake8 --select=O10`` subprocess over a tenth of the corpus (flake8
+  runs all of its other checks too, which makes it far slower).
+``async``
+  :func:`~flake8_ownership_cli.scan` with 32 reads in flight.
+``docstring``
+  Same as ``direct``, but with ``ownership-docstring-only`` set and the
+  AST parsed up front too (flake8 parses it anyway).
+``report``
+  Counts the tag values into an :class:`~flake8_ownership_cli.Inventory`, as
+  ``flake8-ownership --report`` does in each process.
+``batch``
+  :func:`~flake8_ownership_cli.check_headers` over all of the files at once,
+  with the headers read up front.
+``cold-cache``
+  Same as ``file``, but with ``ownership-cache-dir`` set to an empty
+  directory, and :meth:`~flake8_ownership.Checker.parse_options` (which
+  prunes the cache) included in the time.
+``warm-cache``
+  Same as ``cold-cache``, but the cache already has an entry for every
+  file, plus :data:`cache_padding` entries for other files (as a cache
+  shared by a large repository would).
+
+Scenarios in :data:`latency` simulate a slow filesystem by sleeping before
+each read. Only the ``file`` mode (which, for these, is
+:func:`~flake8_ownership_cli.scan` with one read in flight) and ``async`` run
+for them.
+
+Every scenario/mode pair runs in its own process, so that the peak RSS
+reported for it is its own. On Linux, the bytes read per file (with
+``read()`` and the like; pages of memory-mapped files are not counted)
+are reported too. Run with ``--help`` for the options.
+
+The ``startup`` scenario times, in a fresh interpreter that has already
+imported flake8, importing the extension (``import`` mode) and calling
+:meth:`~flake8_ownership.Checker.parse_options` with nothing configured
+(``options`` mode). The best of ten runs is reported, with "files/s"
+being runs per second.
+"""
+import argparse
+import ast
+import collections
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+
+try:
+    import resource
+except ImportError:  # pragma: no cover (windows)
+    resource = None
+
+from flake8_ownership import Checker
+from flake8_ownership_cli import _inventory_file, _read_header, \
+    check_headers, Inventory, scan
+
+
+#: Docstring with valid ownership tags.
+#:
+#: :type: :class:`str`
+docstring = '''"""
+Synthetic module %i.
+
+:author: Joe Joyce <joe@decafjoe.com>
+:copyright: Copyright (c) Joe Joyce, 2016
+:license: BSD
+"""
+'''
+
+#: Line of filler code; formatted with the line number.
+#:
+#: :type: :class:`str`
+filler = 'value_%%i = "%s"  # Filler.\n' % ('x' * 32)
+
+#: Options shared by all scenarios, in flake8's attribute form.
+#:
+#: :type: :class:`dict`
+default_options = dict(
+    author_re=r'^Joe Joyce <joe@decafjoe.com>$',
+    copyright_re=r'^Copyright \(c\) Joe Joyce<COMMA> 2016$',
+    license_re=r'^BSD$',
+)
+
+
+def compliant(i):
+    """Return a file with the tags in the header and 100 lines of code."""
+    return docstring % i + ''.join(filler % j for j in range(100))
+
+
+def missing(i):
+    """Return a file with no tags and 100 lines of code."""
+    return '"""Synthetic module %i."""\n' % i + \
+        ''.join(filler % j for j in range(100))
+
+
+def late(i):
+    """Return a file with the tags after 500 lines of code."""
+    code = ''.join(filler % j for j in range(500))
+    return code + 'x = ' + docstring % i
+
+
+def huge(i):
+    """Return a file with no tags and 50,000 lines of code."""
+    return '"""Synthetic module %i."""\n' % i + \
+        ''.join(filler % j for j in range(50000))
+
+
+def many_authors(literal=False):
+    """
+    Return options with 300 allowed authors, the valid one last.
+
+    :param bool literal: Whether to escape the ``.`` in the other authors,
+                         which makes all of them literals.
+    """
+    dot = r'\.' if literal else '.'
+    authors = [r'^Author %i <author%i@example%scom>$' % (i, i, dot)
+               for i in range(299)]
+    authors.append(default_options['author_re'].replace('.', dot))
+    options = dict(default_options)
+    options['author_re'] = ','.join(authors)
+    return options
+
+
+#: Scenario name to ``(generate, files, options)``, where ``generate`` is a
+#: function that returns the content of the ``i``-th file, ``files`` is the
+#: number of files (before scaling), and ``options`` are the checker
+#: options.
+#:
+#: :type: :class:`collections.OrderedDict`
+scenarios = collections.OrderedDict((
+    ('compliant', (compliant, 2000, default_options)),
+    ('missing', (missing, 2000, default_options)),
+    ('late', (late, 500, default_options)),
+    ('huge', (huge, 20, default_options)),
+    ('many-regexes', (compliant, 2000, many_authors())),
+    ('many-literals', (compliant, 2000, many_authors(literal=True))),
+    ('slow-fs', (compliant, 500, default_options)),
+    ('unconfigured', (compliant, 2000, {})),
+))
+
+#: Scenario name to simulated latency of each read, in seconds.
+#:
+#: :type: :class:`dict`
+latency = {'slow-fs': 0.005}
+
+#: Benchmark modes, see the module docstring.
+#:
+#: :type: :class:`tuple` of :class:`str`
+modes = ('direct', 'file', 'reopen', 'flake8', 'async', 'docstring',
+         'report', 'batch', 'cold-cache', 'warm-cache')
+
+#: Number of entries for other files in the cache in the ``warm-cache``
+#: mode (before scaling).
+#:
+#: :type: :class:`int`
+cache_padding = 50000
+
+
+#: Code run by :func:`startup` to time importing the extension; it prints
+#: the times as a JSON list.
+#:
+#: :type: :class:`str`
+startup_code = """
+import argparse, json, timeit
+import flake8.checker, flake8.main.application
+start = timeit.default_timer()
+import flake8_ownership
+imported = timeit.default_timer()
+flake8_ownership.Checker.parse_options(argparse.Namespace())
+print(json.dumps([imported - start, timeit.default_timer() - imported]))
+"""
+
+
+def generate(directory, scenario, scale):
+    """
+    Generate the corpus for ``scenario`` in ``directory``.
+
+    :param str directory: Directory in which to write the files.
+    :param str scenario: Name of the scenario.
+    :param float scale: Factor by which to scale the number of files.
+    """
+    content, files, _ = scenarios[scenario]
+    for i in range(max(1, int(files * scale))):
+        path = os.path.join(directory, 'module_%05i.py' % i)
+        with open(path, 'w') as f:
+            f.write(content(i))
+
+
+def peak_rss(who):
+    """
+    Return the peak RSS in MiB of ``who``, or :data:`None` if unknown.
+
+    :param who: :data:`resource.RUSAGE_SELF` or
+                :data:`resource.RUSAGE_CHILDREN`.
+    :rtype: :class:`float` or :data:`None`
+    """
+    if resource is None:
+        return None
+    rss = resource.getrusage(who).ru_maxrss
+    if sys.platform == 'darwin':
+        return rss / 1024.0 / 1024.0
+    return rss / 1024.0
+
+
+def bytes_read():
+    """
+    Return the number of bytes this process has read, if known.
+
+    :return: ``rchar`` from ``/proc/self/io``, or :data:`None` where there
+             is no such file.
+    :rtype: :class:`int` or :data:`None`
+    """
+    try:
+        with open('/proc/self/io') as f:
+            for line in f:
+                if line.startswith('rchar:'):
+                    return int(line.split()[1])
+    except EnvironmentError:
+        pass
+    return None
+
+
+def pad_cache(directory, entries):
+    """
+    Add ``entries`` small entries for other files to the cache.
+
+    :param str directory: Cache directory.
+    :param int entries: Number of entries to add.
+    """
+    for i in range(entries):
+        subdirectory = os.path.join(directory, '%02x' % (i % 256))
+        if not os.path.isdir(subdirectory):
+            os.makedirs(subdirectory)
+        path = os.path.join(subdirectory, 'padding%07i' % i)
+        with open(path, 'w') as f:
+            f.write('{"errors": [], "values": {}}')
+        # Older than every real entry, like entries for files that have
+        # not been checked in a while.
+        os.utime(path, (0, 0))
+
+
+def measure(scenario, mode, directory, scale=1.0):
+    """
+    Check the corpus in ``directory`` in ``mode`` and return measurements.
+
+    This is called in a fresh process (see :func:`run`).
+
+    :param str scenario: Name of the scenario.
+    :param str mode: One of :data:`modes`.
+    :param str directory: Directory containing the corpus.
+    :param float scale: Factor by which to scale :data:`cache_padding`.
+    :return: Measurements, as a JSON-serializable :class:`dict`.
+    :rtype: :class:`dict`
+    """
+    options = scenarios[scenario][2]
+    paths = sorted(os.path.join(directory, name)
+                   for name in os.listdir(directory))
+    if mode == 'flake8':
+        paths = paths[:max(1, len(paths) // 10)]
+        command = [sys.executable, '-m', 'flake8', '--isolated',
+                   '--select=O10', '--exit-zero']
+        for key, value in sorted(options.items()):
+            command.append('--%s=%s' % (key.replace('_', '-'), value))
+        start = timeit.default_timer()
+        with open(os.devnull, 'w') as devnull:
+            subprocess.check_call(command + paths, stdout=devnull)
+        seconds = timeit.default_timer() - start
+        rss = peak_rss(getattr(resource, 'RUSAGE_CHILDREN', None))
+        read_per_file = None
+    else:
+        options = dict(options, ownership_docstring_only=mode == 'docstring')
+        cache = None
+        if mode in ('cold-cache', 'warm-cache'):
+            cache = tempfile.mkdtemp()
+            options['ownership_cache_dir'] = cache
+            options['ownership_cache_size'] = 1024 * 1024 * 1024
+            options['ownership_cache_entries'] = 1000000
+        options = argparse.Namespace(**options)
+        Checker.parse_options(options)
+        if mode == 'warm-cache':
+            pad_cache(cache, int(cache_padding * scale))
+            for path in paths:
+                for _ in Checker(None, path).run():
+                    pass
+        contents, trees = {}, {}
+        if mode in ('direct', 'reopen', 'docstring'):
+            for path in paths:
+                with open(path) as f:
+                    contents[path] = f.readlines()
+        if mode == 'docstring':
+            for path in paths:
+                trees[path] = ast.parse(''.join(contents[path]))
+        if mode == 'batch':
+            headers = [_read_header(path) for path in paths]
+        delay = latency.get(scenario)
+        read = None
+        if delay is not None:
+            def read(path):
+                time.sleep(delay)
+                return _read_header(path)
+        seconds, read_per_file = None, None
+        for _ in range(3):
+            before = bytes_read()
+            if mode == 'cold-cache':
+                shutil.rmtree(cache)
+                os.mkdir(cache)
+            start = timeit.default_timer()
+            if cache is not None:
+                Checker.parse_options(options)
+                for path in paths:
+                    for _ in Checker(None, path).run():
+                        pass
+            elif mode == 'batch':
+                check_headers(headers, paths)
+            elif mode == 'report':
+                inventory = Inventory()
+                for path in paths:
+                    inventory.add(_inventory_file(path)[1])
+            elif mode == 'async' or read is not None:
+                concurrency = 32 if mode == 'async' else 1
+                for _ in scan(paths, concurrency, read):
+                    pass
+            else:
+                for path in paths:
+                    tree, lines = trees.get(path), contents.get(path)
+                    if mode == 'reopen':
+                        with open(path) as f:
+                            lines = list(f)
+                    for _ in Checker(tree, path, lines).run():
+                        pass
+            elapsed = timeit.default_timer() - start
+            seconds = elapsed if seconds is None else min(seconds, elapsed)
+            after = bytes_read()
+            if before is not None and after is not None:
+                read_per_file = (after - before) / float(len(paths))
+        rss = peak_rss(getattr(resource, 'RUSAGE_SELF', None))
+        if cache is not None:
+            shutil.rmtree(cache)
+    return dict(
+        bytes_read_per_file=read_per_file,
+        files=len(paths),
+        files_per_second=len(paths) / seconds,
+        mode=mode,
+        peak_rss=rss,
+        scenario=scenario,
+        seconds=seconds,
+    )
+
+
+def run(scenario, mode, directory, scale=1.0):
+    """
+    Run :func:`measure` in a fresh process and return its result.
+
+    :param str scenario: Name of the scenario.
+    :param str mode: One of :data:`modes`.
+    :param str directory: Directory containing the corpus.
+    :param float scale: Factor by which to scale :data:`cache_padding`.
+    :return: Measurements.
+    :rtype: :class:`dict`
+    """
+    command = [sys.executable, os.path.abspath(__file__), '--measure',
+               scenario, mode, directory, str(scale)]
+    output = subprocess.check_output(command, env=environment())
+    return json.loads(output.decode('utf-8'))
+
+
+def environment():
+    """
+    Return the environment for subprocesses, which can import the extension.
+
+    :rtype: :class:`dict`
+    """
+    env = dict(os.environ)
+    here = os.path.dirname(os.path.abspath(__file__))
+    env['PYTHONPATH'] = os.pathsep.join(
+        [here] + [p for p in env.get('PYTHONPATH', '').split(os.pathsep) if p],
+    )
+    return env
+
+
+def startup(repeat=10):
+    """
+    Time importing the extension and parsing empty options.
+
+    :param int repeat: Number of fresh interpreters to run the code in.
+    :return: Measurements for the ``import`` and ``options`` modes.
+    :rtype: :class:`list` of :class:`dict`
+    """
+    best = None
+    for _ in range(repeat):
+        output = subprocess.check_output(
+            [sys.executable, '-c', startup_code],
+            env=environment(),
+        )
+        times = json.loads(output.decode('utf-8'))
+        best = times if best is None else list(map(min, best, times))
+    return [
+        dict(
+            bytes_read_per_file=None,
+            files=1,
+            files_per_second=1 / seconds,
+            mode=mode,
+            peak_rss=None,
+            scenario='startup',
+            seconds=seconds,
+        )
+        for mode, seconds in zip(('import', 'options'), best)
+    ]
+
+
+def compare(results, baseline, threshold):
+    """
+    Return descriptions of regressions in ``results`` against ``baseline``.
+
+    :param results: Results from :func:`run`.
+    :type results: :class:`list` of :class:`dict`
+    :param baseline: Results from a previous run.
+    :type baseline: :class:`list` of :class:`dict`
+    :param float threshold: Allowed drop in throughput, e.g. ``0.2`` for
+                            20%.
+    :return: Descriptions of regressions (empty if there are none).
+    :rtype: :class:`list` of :class:`str`
+    """
+    baseline = dict(((r['scenario'], r['mode']), r) for r in baseline)
+    rv = []
+    for result in results:
+        previous = baseline.get((result['scenario'], result['mode']))
+        if previous is None:
+            continue
+        floor = previous['files_per_second'] * (1 - threshold)
+        if result['files_per_second'] < floor:
+            rv.append('%s/%s: %.1f files/s, baseline %.1f files/s' % (
+                result['scenario'],
+                result['mode'],
+                result['files_per_second'],
+                previous['files_per_second'],
+            ))
+    return rv
+
+
+def main(argv=None):
+    """
+    Run the benchmarks and print the results.
+
+    :param argv: Command line arguments, defaults to :data:`sys.argv`.
+    :type argv: :class:`list` of :class:`str` or :data:`None`
+    :return: Exit status, ``1`` if there was a regression, else ``0``.
+    :rtype: :class:`int`
+    """
+    parser = argparse.ArgumentParser(description='Benchmark the checker.')
+    parser.add_argument(
+        '--scale',
+        default=1.0,
+        help='factor by which to scale the number of files (default: 1)',
+        type=float,
+    )
+    parser.add_argument(
+        '--scenario',
+        action='append',
+        choices=['startup'] + list(scenarios),
+        help='scenario to run, may be repeated (default: all)',
+    )
+    parser.add_argument(
+        '--mode',
+        action='append',
+        choices=modes,
+        help='mode to run, may be repeated (default: all)',
+    )
+    parser.add_argument('--save', help='save the results to this file')
+    parser.add_argument(
+        '--compare',
+        help='fail if throughput dropped compared to the results in this '
+             'file',
+    )
+    parser.add_argument(
+        '--threshold',
+        default=0.2,
+        help='allowed drop in throughput for --compare (default: 0.2)',
+        type=float,
+    )
+    parser.add_argument('--measure', help=argparse.SUPPRESS, nargs=4)
+    args = parser.parse_args(argv)
+
+    if args.measure:
+        scenario, mode, directory, scale = args.measure
+        result = measure(scenario, mode, directory, float(scale))
+        sys.stdout.write(json.dumps(result) + '\n')
+        return 0
+
+    results = []
+    fmt = '%-14s %-10s %7s %9s %11s %9s %9s\n'
+    sys.stdout.write(fmt % ('scenario', 'mode', 'files', 'seconds',
+                            'files/s', 'peak MiB', 'KiB/file'))
+    for scenario in args.scenario or ['startup'] + list(scenarios):
+        if scenario == 'startup':
+            for result in startup():
+                results.append(result)
+                sys.stdout.write(fmt % (
+                    scenario,
+                    result['mode'],
+                    result['files'],
+                    '%.6f' % result['seconds'],
+                    '%.1f' % result['files_per_second'],
+                    '-',
+                    '-',
+                ))
+            continue
+        directory = tempfile.mkdtemp()
+        try:
+            generate(directory, scenario, args.scale)
+            for mode in args.mode or modes:
+                if scenario in latency and mode not in ('file', 'async'):
+                    continue
+                result = run(scenario, mode, directory, args.scale)
+                results.append(result)
+                rss = result['peak_rss']
+                read = result['bytes_read_per_file']
+                sys.stdout.write(fmt % (
+                    scenario,
+                    mode,
+                    result['files'],
+                    '%.3f' % result['seconds'],
+                    '%.1f' % result['files_per_second'],
+                    '-' if rss is None else '%.1f' % rss,
+                    '-' if read is None else '%.1f' % (read / 1024.0),
+                ))
+                sys.stdout.flush()
+        finally:
+            shutil.rmtree(directory)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        for regression in regressions:
+            sys.stderr.write('regression: %s\n' % regression)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
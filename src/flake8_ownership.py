@@ -6,13 +6,35 @@ Flake8 extension for checking author, copyright, and license.
 :copyright: Copyright (c) Joe Joyce and contributors, 2016-2019.
 :license: BSD
 """
+import ast
+import atexit
+import codecs
+import collections
 import datetime
+import itertools
+import json
+import logging
+import os
 import re
+import sys
+import time
+import timeit
+
+try:
+    import configparser
+except ImportError:  # pragma: no cover (python 2)
+    import ConfigParser as configparser  # noqa: N813
+
+#: Logger for diagnostics. It lives under flake8's logger so that
+#: ``flake8 -vv`` shows its output.
+#:
+#: :type: :class:`logging.Logger`
+LOG = logging.getLogger('flake8.ownership')
 
 #: Version of the extension.
 #:
 #: :type: :class:`str`
-__version__ = '2.0.2'
+__version__ = '2.1.0'
 
 #: Regex that matches the ``:author:`` line.
 #:
@@ -29,6 +51,716 @@ copyright_re = re.compile(r'^:copyright: (?P<copyright>.+)$')
 #: :type: :func:`re <re.compile>`
 license_re = re.compile(r'^:license: (?P<license>.+)$')
 
+#: Regex that matches any of the ``:author:``, ``:copyright:``, or
+#: ``:license:`` lines in a single pass.
+#:
+#: :type: :func:`re <re.compile>`
+tag_re = re.compile(r'^:(?P<tag>author|copyright|license): (?P<value>.+)$')
+
+#: Regex that matches any of the tag lines in a bytes buffer. Unlike
+#: :data:`tag_re`, this is matched at offsets into a whole buffer rather
+#: than against individual lines.
+#:
+#: :type: :func:`re <re.compile>`
+bytes_tag_re = re.compile(
+    br'^:(?P<tag>author|copyright|license): (?P<value>[^\r\n]+?)\r?$',
+    re.MULTILINE,
+)
+
+# What follows the ':' that starts the tag in bytes_tag_re, for building
+# regexes that look for tags after something else.
+_bytes_tag_rest = bytes_tag_re.pattern[len(br'^:'):]
+
+#: Regex that matches any of the tag lines in a bytes buffer, along with the
+#: newline before the line. Starting with a literal lets the regex engine
+#: skip straight to the candidates, which makes it several times faster
+#: than :data:`bytes_tag_re` over a buffer with many other lines.
+#:
+#: :type: :func:`re <re.compile>`
+batch_tag_re = re.compile(br'\n:' + _bytes_tag_rest, re.MULTILINE)
+
+#: Regex that matches a PEP 263 encoding declaration.
+#:
+#: :type: :func:`re <re.compile>`
+coding_re = re.compile(br'^[ \t\f]*#.*?coding[:=][ \t]*(?P<coding>[-\w.]+)')
+
+
+#: Regex that matches a repeat in a regex (like ``*``, ``?``, or ``{2,}``),
+#: capturing it as ``unbounded`` if it has no upper limit.
+#:
+#: :type: :func:`re <re.compile>`
+repeat_re = re.compile(
+    r'(?:(?P<unbounded>[*+]|\{\d*,\})|\?|\{\d+\}|\{\d*,\d+\})[?+]?',
+)
+
+
+def _literal(pattern):
+    # Return the string matched by pattern if it is nothing but an anchored
+    # literal (with escaped punctuation), else None.
+    if len(pattern) < 2 or pattern[0] != '^' or pattern[-1] != '$':
+        return None
+    rv, escaped = [], False
+    for c in pattern[1:-1]:
+        if escaped:
+            if c.isalnum() or c == '_':
+                # A class like \d or \w, or a backreference.
+                return None
+            rv.append(c)
+            escaped = False
+        elif c == '\\':
+            escaped = True
+        elif c in '.^$*+?{}[]|()':
+            return None
+        else:
+            rv.append(c)
+    if escaped:
+        # The trailing $ was escaped, so it is not an anchor.
+        return None
+    return ''.join(rv)
+
+
+def _placeholders(pattern, prefix):
+    # Return pattern with each <YEAR> replaced by a named group that matches
+    # any year, and the names of those groups (prefix0, prefix1, ...).
+    parts = pattern.split('<YEAR>')
+    names = tuple('%s%i' % (prefix, i) for i in range(len(parts) - 1))
+    rv = [parts[0]]
+    for name, part in zip(names, parts[1:]):
+        rv.append('(?P<%s>[0-9]{4})' % name)
+        rv.append(part)
+    return ''.join(rv), names
+
+
+def _fill_year(regexes, year):
+    # Return (string, compiled) regexes with each <YEAR> filled in for year,
+    # as they are published on Checker.author_re and friends. Only the dated
+    # ones are compiled again, and the re module caches those.
+    text, rv = str(year), []
+    for string, regex in regexes:
+        if '<YEAR>' in string:
+            string = string.replace('<YEAR>', text)
+            regex = re.compile(string)
+        rv.append((string, regex))
+    return rv
+
+
+def _year_matches(match, names, year):
+    # Return whether every placeholder that took part in match has year.
+    for name in names:
+        found = match.group(name)
+        if found is not None and int(found) != year:
+            return False
+    return True
+
+
+def _star_height(pattern):
+    # Return how deeply unbounded repeats nest in pattern: 0 for ^BSD$, 1 for
+    # ^a+$, 2 for ^(a+)+$. Nested ones can match a string in exponentially
+    # many ways, all of which the regex engine tries before failing. The
+    # standard library's regex parser is private, but this only needs to
+    # know where the groups, character classes, escapes, and repeats are.
+    heights = [0]  # Deepest repeat so far in each open group.
+    last = None  # Height of the atom a repeat would apply to.
+    i, n = 0, len(pattern)
+    while i < n:
+        c = pattern[i]
+        if c == '\\':
+            i, last = i + 2, 0
+        elif c == '[':
+            i += 1
+            if pattern[i:i + 1] == '^':
+                i += 1
+            if pattern[i:i + 1] == ']':
+                i += 1
+            while i < n and pattern[i] != ']':
+                i += 2 if pattern[i] == '\\' else 1
+            i, last = i + 1, 0
+        elif pattern.startswith('(?#', i):
+            end = pattern.find(')', i)
+            i = n if end < 0 else end + 1
+        elif c == '(':
+            heights.append(0)
+            i, last = i + 1, None
+        elif c == ')':
+            last = heights.pop() if len(heights) > 1 else 0
+            heights[-1] = max(heights[-1], last)
+            i += 1
+        else:
+            repeat = repeat_re.match(pattern, i)
+            if repeat is None:
+                i, last = i + 1, 0
+                continue
+            if last is not None:
+                unbounded = repeat.group('unbounded') is not None
+                heights[-1] = max(heights[-1], last + unbounded)
+            i, last = repeat.end(), None
+    return heights[0]
+
+
+class _MatchTimeout(Exception):
+    pass
+
+
+def _on_alarm(signum, frame):
+    raise _MatchTimeout()
+
+
+def _in_main_thread():
+    import threading
+    try:
+        return threading.current_thread() is threading.main_thread()
+    except AttributeError:  # pragma: no cover (python 2)
+        return threading.current_thread().name == 'MainThread'
+
+
+def _in_main_process():
+    # multiprocessing pulls in socket, select, and more, which only the
+    # standalone scanner needs otherwise.
+    import multiprocessing
+    return multiprocessing.current_process().name == 'MainProcess'
+
+
+def _with_timeout(timeout, function, *args):
+    # Return function(*args), raising _MatchTimeout if that takes longer than
+    # timeout seconds. The time limit needs a SIGALRM, which needs a Unix
+    # main thread (where the handler runs) and nothing else using the
+    # signal; without those, there is no limit. The handler is only
+    # installed while the function runs.
+    import signal
+    if not hasattr(signal, 'setitimer') or not _in_main_thread() or \
+            signal.getsignal(signal.SIGALRM) != signal.SIG_DFL:
+        return function(*args)
+    signal.signal(signal.SIGALRM, _on_alarm)
+    try:
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+        try:
+            return function(*args)
+        finally:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+    finally:
+        signal.signal(signal.SIGALRM, signal.SIG_DFL)
+
+
+def _search(matcher, value, year=None):
+    # Return matcher.search(value, year), raising _MatchTimeout if that takes
+    # longer than Checker.match_timeout (if set), for the code paths that
+    # match one value at a time.
+    timeout = Checker.match_timeout
+    if timeout <= 0 or not matcher.searches:
+        return matcher.search(value, year)
+    return _with_timeout(timeout, matcher.search, value, year)
+
+
+class Matcher(object):
+    """
+    Match a value against a list of regexes with a single search.
+
+    Regexes that are really anchored literals, like ``^BSD$``, are looked up
+    in a :class:`dict` instead of being searched, so any number of them cost
+    a single lookup. The remaining regexes without groups of their own are
+    combined into one alternation, where each alternative is wrapped in a
+    named group so the matching alternative can be identified. Regexes that
+    cannot be combined (because they have groups, which combining would
+    renumber, or inline flags, which would apply to every alternative) are
+    searched one at a time afterwards.
+
+    ``<YEAR>`` placeholders are left in the patterns. In a regex, each one
+    is a named group that matches any four digits, which are compared to
+    the year after the match. In a literal, it is filled in the first time
+    the literals are looked up for a given year. Either way nothing is
+    compiled again when the year changes. In the rare case that a
+    placeholder matched some other year, the regexes are searched again one
+    at a time with the year filled in, in case some other match would have
+    had the right year.
+
+    Since literals are checked first, if a value matches both a literal and
+    an earlier regex, the literal is the one reported as matching.
+
+    :param regexes: List of ``(string, compiled)`` regex tuples, with any
+                    ``<YEAR>`` placeholders left in the strings, as cached
+                    in :data:`compile_cache`.
+    :type regexes: :class:`list`
+    """
+
+    def __init__(self, regexes):
+        """Build the combined regex for ``regexes``."""
+        #: Source strings of the regexes, in configuration order, with any
+        #: ``<YEAR>`` placeholders left in.
+        #:
+        #: :type: :class:`tuple` of :class:`str`
+        self.patterns = tuple(string for string, _ in regexes)
+
+        #: Whether any of the regexes has a ``<YEAR>`` placeholder.
+        #:
+        #: :type: :class:`bool`
+        self.dated = any('<YEAR>' in string for string in self.patterns)
+
+        flags = re.compile('').flags
+        combined, others, literals = [], [], []
+        self._names = {}
+        for i, (string, regex) in enumerate(regexes):
+            literal = None
+            if regex.flags == flags:
+                literal = _literal(string)
+            years = string.count('<YEAR>')
+            if literal is not None:
+                literals.append((literal, i))
+            elif regex.groups == years and regex.flags == flags:
+                pattern, self._names[i] = _placeholders(string, '_%iy' % i)
+                combined.append((i, regex, '(?P<_%i>%s)' % (i, pattern)))
+            else:
+                names = _placeholders(string, '_year')[1]
+                others.append((i, regex, names))
+
+        self._literals = {}
+        for literal, i in literals:
+            self._literals.setdefault(literal, i)
+        self._dated_literals = None
+        if any('<YEAR>' in literal for literal, _ in literals):
+            self._dated_literals = literals
+        # (year, literals) for the last year the literals were filled in for.
+        self._filled = (None, None)
+
+        #: Whether any regexes are searched, rather than looked up as
+        #: literals (only searching can be slow).
+        #:
+        #: :type: :class:`bool`
+        self.searches = bool(combined or others)
+
+        self._combined = None
+        if len(combined) > 1:
+            try:
+                pattern = '|'.join(string for _, _, string in combined)
+                self._combined = re.compile(pattern)
+            except (AssertionError, re.error):
+                # Older Pythons cap the number of groups in a regex.
+                pass
+        if self._combined is None:
+            others.extend(
+                (i, regex, _placeholders(self.patterns[i], '_year')[1])
+                for i, regex, _ in combined
+            )
+            others.sort(key=lambda other: other[0])
+        self._others = others
+
+    def _literals_for(self, year):
+        # Return the literals with the placeholders filled in for year.
+        filled_year, literals = self._filled
+        if filled_year != year:
+            literals, text = {}, str(year)
+            for literal, i in self._dated_literals:
+                literals.setdefault(literal.replace('<YEAR>', text), i)
+            # Replaced in one go, so a thread in the middle of a lookup
+            # does not see one year's literals under another's year.
+            self._filled = (year, literals)
+        return literals
+
+    def _exact(self, i, value, year):
+        # Return whether regex i matches value with its placeholders filled
+        # in for year, as they used to be before placeholders were checked
+        # after the match. The re module caches the compiled regex.
+        pattern = self.patterns[i].replace('<YEAR>', str(year))
+        return re.search(pattern, value) is not None
+
+    def search(self, value, year=None):
+        """
+        Return the index of the regex that matches ``value``.
+
+        :param str value: Value to match.
+        :param int year: Year that ``<YEAR>`` stands for, defaults to the
+                         current year per :attr:`Checker.clock`.
+        :return: Index into :attr:`patterns` of the regex that matched, or
+                 :data:`None` if none of them match.
+        :rtype: :class:`int` or :data:`None`
+        """
+        if self.dated and year is None:
+            year = Checker.clock().year
+        literals = self._literals
+        if self._dated_literals is not None:
+            literals = self._literals_for(year)
+        index = literals.get(value)
+        if index is not None:
+            return index
+        if self._combined is not None:
+            match = self._combined.search(value)
+            if match is not None:
+                index = int(match.lastgroup[1:])
+                names = self._names[index]
+                if not names or _year_matches(match, names, year):
+                    return index
+                # Some alternative might still match, with the right year
+                # or further along the value, so try them one at a time.
+                for i in sorted(self._names):
+                    if self._exact(i, value, year):
+                        return i
+        for i, regex, names in self._others:
+            match = regex.search(value)
+            if match is None:
+                continue
+            if not names or _year_matches(match, names, year) or \
+                    self._exact(i, value, year):
+                return i
+        return None
+
+
+class Tag(collections.namedtuple('Tag', (
+    'name',
+    'code',
+    'bit',
+    'expected',
+    'missing',
+    'unrecognized',
+    'timeout',
+))):
+    """
+    Configured tag, with everything needed to check it precomputed.
+
+    :param str name: Name of the tag, e.g. ``'author'``.
+    :param str code: Error code for the tag, e.g. ``'O100'``.
+    :param int bit: Bit identifying the tag in :attr:`Plan.mask`.
+    :param expected: Matcher for the valid values.
+    :type expected: :class:`Matcher`
+    :param str missing: Message for when the tag is missing.
+    :param str unrecognized: Message for when the value is not valid.
+    :param str timeout: Message for when checking the value took too long.
+    """
+
+    __slots__ = ()
+
+
+class Plan(object):
+    """
+    Immutable description of the configured tags.
+
+    This is built once, in :meth:`Checker.parse_options`, so that checking a
+    file only has to iterate over it.
+
+    :param tags: ``(name, code, expected)`` tuples for the configured tags,
+                 in the order they are reported.
+    :type tags: iterable
+    """
+
+    __slots__ = ('tags', 'index', 'codes', 'mask')
+
+    def __init__(self, tags):
+        """Build the :class:`Tag` records."""
+        rv, index, codes, mask = [], {}, {}, 0
+        for i, (name, code, expected) in enumerate(tags):
+            tag = Tag(
+                name=name,
+                code=code,
+                bit=1 << i,
+                expected=expected,
+                missing='%s missing %s' % (code, name),
+                unrecognized='%s unrecognized %s' % (code, name),
+                timeout='%s3 timed out checking %s' % (code[:-1], name),
+            )
+            rv.append(tag)
+            index[name] = tag
+            codes[code] = tag
+            mask |= tag.bit
+
+        #: Configured tags, in the order they are reported.
+        #:
+        #: :type: :class:`tuple` of :class:`Tag`
+        self.tags = tuple(rv)
+
+        #: Map of tag name to :class:`Tag`.
+        #:
+        #: :type: :class:`dict`
+        self.index = index
+
+        #: Map of error code to :class:`Tag`.
+        #:
+        #: :type: :class:`dict`
+        self.codes = codes
+
+        #: Bitwise or of the :attr:`Tag.bit` of all configured tags.
+        #:
+        #: :type: :class:`int`
+        self.mask = mask
+
+
+class PolicyIndex(object):
+    """
+    Per-directory :class:`Plan` overrides, indexed by path prefix.
+
+    The directories are stored in a trie of path components, so looking up
+    a file takes one step per directory in its path, however many policies
+    there are.
+
+    :param policies: ``(directory, plan, fingerprint)`` tuples, where
+                     ``directory`` is an absolute path, ``plan`` is the
+                     :class:`Plan` for files under it, and ``fingerprint`` is
+                     the cache fingerprint for that plan.
+    :type policies: iterable
+    """
+
+    __slots__ = ('policies', 'root')
+
+    def __init__(self, policies):
+        """Build the trie."""
+        #: Policies, as passed in.
+        #:
+        #: :type: :class:`tuple`
+        self.policies = tuple(policies)
+
+        root = {}
+        for directory, plan, fingerprint in self.policies:
+            node = root
+            for part in _path_parts(directory):
+                node = node.setdefault(part, {})
+            # None is never a path component, so it holds the node's policy.
+            node[None] = (plan, fingerprint)
+
+        #: Root of the trie: a :class:`dict` of path component to child node,
+        #: plus the ``(plan, fingerprint)`` for the directory under the key
+        #: :data:`None`.
+        #:
+        #: :type: :class:`dict`
+        self.root = root
+
+    def lookup(self, path):
+        """
+        Return the policy for the file at ``path``.
+
+        :param str path: Path to the file.
+        :return: ``(plan, fingerprint)`` for the innermost directory with a
+                 policy that contains ``path``, or :data:`None` if there is
+                 none.
+        :rtype: :class:`tuple` or :data:`None`
+        """
+        node, rv = self.root, None
+        for part in _path_parts(path):
+            node = node.get(part)
+            if node is None:
+                break
+            rv = node.get(None, rv)
+        return rv
+
+
+class Profile(object):
+    """
+    How tag lines look in a type of file, with the regexes to find them.
+
+    In Python files, tag lines are bare (``:license: BSD``), since they live
+    in the module docstring. In other files they are in comments, after a
+    prefix like ``#`` (``# :license: BSD``). The prefix must start the line,
+    and may be followed by spaces or tabs.
+
+    :param str prefix: Comment prefix, ``''`` for bare tag lines.
+    """
+
+    __slots__ = ('prefix', 'start', 'needle', 'line_re', 'buffer_re')
+
+    def __init__(self, prefix):
+        """Compile the regexes for ``prefix``."""
+        #: Comment prefix, ``''`` for bare tag lines.
+        #:
+        #: :type: :class:`str`
+        self.prefix = prefix
+
+        #: What a tag line starts with (the prefix, or ``':'``).
+        #:
+        #: :type: :class:`str`
+        self.start = prefix or ':'
+
+        #: What precedes a tag line in a buffer, used to jump from candidate
+        #: to candidate.
+        #:
+        #: :type: :class:`bytes`
+        self.needle = b'\n' + self.start.encode('utf-8')
+
+        if prefix:
+            head = re.escape(prefix) + r'[ \t]*'
+            #: Regex that matches a tag line (without its line ending), like
+            #: :data:`tag_re`.
+            #:
+            #: :type: :func:`re <re.compile>`
+            self.line_re = re.compile(r'^%s:(?P<tag>author|copyright|license)'
+                                      r': (?P<value>.+)$' % head)
+
+            #: Regex that matches a tag line in a bytes buffer, like
+            #: :data:`bytes_tag_re`.
+            #:
+            #: :type: :func:`re <re.compile>`
+            self.buffer_re = re.compile(
+                (r'^%s:' % head).encode('utf-8') + _bytes_tag_rest,
+                re.MULTILINE,
+            )
+        else:
+            self.line_re, self.buffer_re = tag_re, bytes_tag_re
+
+
+class Profiles(object):
+    """
+    :class:`Profile` for each file extension.
+
+    Files with an extension that has no profile are taken to be Python,
+    with bare tag lines.
+
+    :param prefixes: Map of extension (with the dot, like ``'.sh'``) to
+                     comment prefix.
+    :type prefixes: :class:`dict`
+    """
+
+    __slots__ = ('default', 'by_extension', 'extensions', 'batch_re')
+
+    def __init__(self, prefixes):
+        """Build a :class:`Profile` for each prefix."""
+        #: Profile for files with an extension not in :attr:`by_extension`.
+        #:
+        #: :type: :class:`Profile`
+        self.default = Profile('')
+
+        profiles = {'': self.default}
+        for prefix in set(prefixes.values()):
+            profiles.setdefault(prefix, Profile(prefix))
+
+        #: Map of extension to :class:`Profile`.
+        #:
+        #: :type: :class:`dict`
+        self.by_extension = dict(
+            (extension, profiles[prefix])
+            for extension, prefix in prefixes.items()
+        )
+
+        #: Extensions of the files to look for in directories.
+        #:
+        #: :type: :class:`frozenset`
+        self.extensions = frozenset(['.py']) | frozenset(prefixes)
+
+        #: Regex that matches a tag line with any of the prefixes, like
+        #: :data:`batch_tag_re`. The ``prefix`` group holds the prefix (and
+        #: the blanks after it).
+        #:
+        #: :type: :func:`re <re.compile>`
+        self.batch_re = batch_tag_re
+        if len(profiles) > 1:
+            # Longest first, so a prefix is not cut short by another that
+            # starts it.
+            heads = sorted(
+                (re.escape(prefix) + r'[ \t]*' if prefix else ''
+                 for prefix in profiles),
+                key=len,
+                reverse=True,
+            )
+            head = r'\n(?P<prefix>%s):' % '|'.join(heads)
+            self.batch_re = re.compile(
+                head.encode('utf-8') + _bytes_tag_rest,
+                re.MULTILINE,
+            )
+
+    def lookup(self, path):
+        """
+        Return the :class:`Profile` for the file at ``path``.
+
+        :param str path: Path to the file.
+        :rtype: :class:`Profile`
+        """
+        if not self.by_extension:
+            return self.default
+        extension = os.path.splitext(path)[1]
+        return self.by_extension.get(extension, self.default)
+
+    def wanted(self, path):
+        """
+        Return whether to check the file at ``path`` found in a directory.
+
+        :param str path: Path to the file.
+        :rtype: :class:`bool`
+        """
+        return os.path.splitext(path)[1] in self.extensions
+
+
+def _path_parts(path):
+    return os.path.normcase(os.path.abspath(path)).split(os.sep)
+
+
+#: Compiled :class:`PolicyIndex` instances, keyed on the policy file and
+#: everything else they were built from, so that calling
+#: :meth:`Checker.parse_options` again (e.g. in a worker process forked from
+#: the main one) does not compile them again.
+#:
+#: :type: :class:`dict`
+policy_cache = {}
+
+#: Compiled ``-re`` options, keyed on the raw option value, so that calling
+#: :meth:`Checker.parse_options` again (e.g. in the watch daemon, a test
+#: suite, or an editor integration) does not compile them again. Each
+#: entry is ``(regexes, matcher, nested)``, where ``nested`` lists the
+#: regexes with nested repeats. Since ``<YEAR>`` is only filled in when
+#: matching, entries stay valid when the year changes. Beyond
+#: :data:`compile_cache_size` entries, the least recently used one is
+#: dropped.
+#:
+#: :type: :class:`collections.OrderedDict`
+compile_cache = collections.OrderedDict()
+
+#: Maximum number of entries in :data:`compile_cache`.
+#:
+#: :type: :class:`int`
+compile_cache_size = 64
+
+
+class OptionError(ValueError):
+    """
+    Invalid configuration, raised from :meth:`Checker.parse_options`.
+
+    Under flake8, this is also a :exc:`flake8.exceptions.ExecutionError`, so
+    flake8 prints the message and exits instead of printing a traceback. The
+    standalone command reports it as a usage error.
+    """
+
+
+def _option_error(message):
+    # flake8 is slow to import, and is only needed on this path (under
+    # flake8 it has been imported already).
+    try:
+        from flake8.exceptions import ExecutionError
+    except ImportError:  # pragma: no cover (flake8 is a dependency)
+        return OptionError(message)
+    return type('OptionError', (OptionError, ExecutionError), {})(message)
+
+
+def _warn(message):
+    # flake8 drops log messages unless it is run with -v, and these need to
+    # be seen.
+    sys.stderr.write('flake8-ownership: warning: %s\n' % message)
+
+
+class Config(collections.namedtuple('Config', (
+    'plan',
+    'policies',
+    'max_lines',
+    'stop_at_docstring',
+    'docstring_only',
+    'cache_dir',
+    'cache_size',
+    'cache_entries',
+    'fingerprint',
+    'stats_file',
+    'match_timeout',
+    'profiles',
+))):
+    """
+    Processed configuration of :class:`Checker`, as one picklable value.
+
+    :meth:`Checker.parse_options` builds this once, in the main process, and
+    stores it as :attr:`Checker.config`. A process pool can then hand it to
+    :meth:`Checker.configure` in each worker, which installs it without
+    parsing the options, reading the policy file, or analyzing the regexes
+    again. Each :class:`Matcher` pickles as its literals and its combined
+    regex, so a worker compiles one regex per tag, however many patterns
+    were configured. (Compiled regexes cannot be shared between processes,
+    so that is the least a worker started with ``spawn`` can do; forked
+    workers inherit everything and compile nothing.)
+
+    The fields are the :class:`Checker` attributes of the same names.
+    """
+
+    __slots__ = ()
+
 
 class Checker(object):
     """Flake8 checker class that checks for author, copyright, and license."""
@@ -48,6 +780,11 @@ class Checker(object):
     #: :type: :class:`str`
     version = __version__
 
+    #: Names of the tags, in the order of their error codes.
+    #:
+    #: :type: :class:`tuple` of :class:`str`
+    tags = ('author', 'copyright', 'license')
+
     #: List of regexes of valid :author: values.
     #:
     #: :type: :class:`list` of :mod:`re` instances.
@@ -63,6 +800,98 @@ class Checker(object):
     #: :type: :class:`list` of :mod:`re` instances.
     license_re = None
 
+    #: Configured tags.
+    #:
+    #: :type: :class:`Plan`
+    plan = Plan(())
+
+    #: Per-directory overrides of :attr:`plan`, :data:`None` if there are
+    #: none.
+    #:
+    #: :type: :class:`PolicyIndex` or :data:`None`
+    policies = None
+
+    #: Maximum number of lines to scan for tags, ``0`` for no limit.
+    #:
+    #: :type: :class:`int`
+    max_lines = 0
+
+    #: Whether to stop scanning at the end of the module docstring.
+    #:
+    #: :type: :class:`bool`
+    stop_at_docstring = False
+
+    #: Whether to look for tags in the module docstring only, as parsed by
+    #: flake8, instead of scanning the file.
+    #:
+    #: :type: :class:`bool`
+    docstring_only = False
+
+    #: Directory in which to cache results, :data:`None` to disable caching.
+    #:
+    #: :type: :class:`str` or :data:`None`
+    cache_dir = None
+
+    #: Size, in bytes, beyond which the oldest cache entries are evicted.
+    #:
+    #: :type: :class:`int`
+    cache_size = 16 * 1024 * 1024
+
+    #: Number of cache entries beyond which the oldest ones are evicted.
+    #:
+    #: :type: :class:`int`
+    cache_entries = 65536
+
+    #: Time, in seconds, that must pass after the cache was pruned before
+    #: it is pruned again.
+    #:
+    #: :type: :class:`float`
+    prune_interval = 600.0
+
+    #: Hash of the configuration, which is part of every cache key. It is
+    #: computed from the regexes with their ``<YEAR>`` placeholders, so it
+    #: does not change with the year (the year is part of each cache key
+    #: instead).
+    #:
+    #: :type: :class:`str`
+    fingerprint = ''
+
+    #: Path of the file to which per-file statistics are appended,
+    #: :data:`None` to disable statistics.
+    #:
+    #: :type: :class:`str` or :data:`None`
+    stats_file = None
+
+    #: Time, in seconds, that matching the values found in a file against
+    #: the regexes may take before the file fails with a timeout, ``0`` for
+    #: no limit.
+    #:
+    #: :type: :class:`float`
+    match_timeout = 0.0
+
+    #: Whether ``-re`` regexes with nested repeats (including those in the
+    #: policy file) are an error rather than a warning.
+    #:
+    #: :type: :class:`bool`
+    reject_nested_repeats = False
+
+    #: Comment-prefix profiles, by file extension.
+    #:
+    #: :type: :class:`Profiles`
+    profiles = Profiles({})
+
+    #: Function that returns today's :class:`datetime.date`, whose year is
+    #: what ``<YEAR>`` stands for. Replace it (as a :func:`staticmethod`) to
+    #: pin the date, e.g. in tests.
+    #:
+    #: :type: :term:`callable`
+    clock = staticmethod(datetime.date.today)
+
+    #: Everything above, as set by :meth:`parse_options`.
+    #:
+    #: :type: :class:`Config` or :data:`None`
+    config = None
+
     @classmethod
     def add_options(cls, parser):
         """Add --author-re, --copyright-re, and --license-re options."""
@@ -81,20 +910,152 @@ class Checker(object):
             help='regular expression(s) for valid :license: lines',
             parse_from_config=True,
         )
+        parser.add_option(
+            '--ownership-policies',
+            help='file with per-directory sections of -re options, which '
+                 'override the global ones for files in that directory',
+            normalize_paths=True,
+            parse_from_config=True,
+        )
+        parser.add_option(
+            '--ownership-max-lines',
+            default=0,
+            help='maximum number of lines to scan for tags (default: no '
+                 'limit)',
+            parse_from_config=True,
+            type='int',
+        )
+        parser.add_option(
+            '--ownership-stop-at-docstring',
+            action='store_true',
+            default=False,
+            help='stop scanning for tags at the end of the module docstring',
+            parse_from_config=True,
+        )
+        parser.add_option(
+            '--ownership-docstring-only',
+            action='store_true',
+            default=False,
+            help='only look for tags in the module docstring (found by '
+                 'parsing the file) instead of scanning the file',
+            parse_from_config=True,
+        )
+        parser.add_option(
+            '--ownership-cache-dir',
+            help='directory in which to cache results (default: no cache)',
+            parse_from_config=True,
+        )
+        parser.add_option(
+            '--ownership-cache-size',
+            default=cls.cache_size,
+            help='maximum size of the cache in bytes (default: 16 MiB)',
+            parse_from_config=True,
+            type='int',
+        )
+        parser.add_option(
+            '--ownership-cache-entries',
+            default=cls.cache_entries,
+            help='maximum number of entries in the cache (default: %i)' %
+                 cls.cache_entries,
+            parse_from_config=True,
+            type='int',
+        )
+        parser.add_option(
+            '--ownership-stats',
+            help='record timing statistics for each file to this file and '
+                 'print a summary at exit',
+            parse_from_config=True,
+        )
+        parser.add_option(
+            '--ownership-comment-prefixes',
+            help='comma-separated "extensions=prefix" entries, for files '
+                 'whose tag lines follow a comment prefix (e.g. '
+                 '".sh .yml=#")',
+            parse_from_config=True,
+        )
+        parser.add_option(
+            '--ownership-match-timeout',
+            default=cls.match_timeout,
+            help='seconds that matching the tags in a file may take before '
+                 'it fails with O103, 0 for no limit (default: 0)',
+            parse_from_config=True,
+            type='float',
+        )
+        parser.add_option(
+            '--ownership-reject-nested-repeats',
+            action='store_true',
+            default=False,
+            help='fail on -re options with nested repeats like (a+)+, '
+                 'instead of warning about them',
+            parse_from_config=True,
+        )
 
     @classmethod
     def _parse_option(cls, options, option):
-        regexes = getattr(options, option, '') or ''
-        regexes = regexes.split(',')
-        if len(regexes) == 1 and regexes[0] == '':
-            return []
+        regexes = cls._compile_option(options, option)[0]
+        return _fill_year(regexes, cls.clock().year)
 
-        rv = []
-        year = str(datetime.datetime.today().year)
-        for r in regexes:
-            regex = r.strip().replace('<COMMA>', ',').replace('<YEAR>', year)
-            rv.append((regex, re.compile(regex)))
-        return rv
+    @classmethod
+    def _compile_option(cls, options, option, section=None):
+        # Return (regexes, matcher) for the option; matcher is None if there
+        # are no regexes. Neither depends on anything but the raw value, so
+        # they come from compile_cache if that value was compiled recently.
+        # section is the policy file section the option is from, if any.
+        value = getattr(options, option, '') or ''
+        if not value:
+            return [], None
+        name = option.replace('_', '-')
+        if section is not None:
+            name = '[%s] %s' % (section, name)
+        entry = compile_cache.pop(value, None)
+        miss = entry is None
+        if miss:
+            try:
+                entry = cls._compile_value(value)
+            except re.error as e:
+                raise _option_error('%s: %s' % (name, e))
+        compile_cache[value] = entry
+        while len(compile_cache) > compile_cache_size:
+            compile_cache.popitem(last=False)
+
+        regexes, matcher, nested = entry
+        for regex in nested:
+            msg = '%s: %r has nested repeats, so a value that does not ' \
+                'match may take exponential time to fail' % (name, regex)
+            if cls.reject_nested_repeats:
+                raise _option_error(msg)
+            if miss:
+                _warn(msg)
+        return regexes, matcher
+
+    @classmethod
+    def _compile_value(cls, value):
+        rv, nested = [], []
+        for r in value.split(','):
+            regex = r.strip().replace('<COMMA>', ',')
+            compiled = re.compile(_placeholders(regex, '_year')[0])
+            if _literal(regex) is None and _star_height(compiled.pattern) > 1:
+                nested.append(regex)
+            rv.append((regex, compiled))
+        return rv, Matcher(rv), nested
+
+    @classmethod
+    def _parse_prefixes(cls, options):
+        value = getattr(options, 'ownership_comment_prefixes', '') or ''
+        prefixes = {}
+        for entry in value.split(','):
+            if not entry.strip():
+                continue
+            extensions, equals, prefix = entry.partition('=')
+            if not equals or not extensions.split():
+                raise _option_error('ownership-comment-prefixes: expected '
+                                    '"extensions=prefix", got %r' %
+                                    entry.strip())
+            for extension in extensions.split():
+                if not extension.startswith('.'):
+                    extension = '.' + extension
+                prefixes[extension] = prefix.strip()
+        return prefixes
 
     @classmethod
     def parse_options(cls, options):
@@ -102,70 +1063,663 @@ class Checker(object):
         Process the supplied configuration.
 
         This populates the :attr:`author_re`, :attr:`copyright_re`, and
-        :attr:`license_re` attributes. For each configuration option, this
-        substitutes ``<COMMA>`` and ``<YEAR>`` as appropriate, then compiles
-        each regex.
+        :attr:`license_re` attributes, with ``<YEAR>`` filled in for the year
+        per :attr:`clock`. For matching, each configuration option is
+        compiled with ``<COMMA>`` substituted and ``<YEAR>`` turned into a
+        placeholder that is checked against the year when matching (see
+        :class:`Matcher`), so that it need not be compiled again when the
+        year changes. Options whose value was compiled before come from
+        :data:`compile_cache` instead. Regexes with
+        nested repeats, like ``(a+)+``, are warned about on stderr (or, with
+        ``--ownership-reject-nested-repeats``, raise :exc:`OptionError`),
+        since they can take exponential time to fail to match. Invalid
+        regexes raise :exc:`OptionError` too. The
+        configured tags are collected in :attr:`plan`, so that :meth:`run`
+        does not have to rebuild them for every file.
+
+        This also populates :attr:`policies`, :attr:`max_lines`,
+        :attr:`stop_at_docstring`, :attr:`docstring_only`, :attr:`cache_dir`,
+        :attr:`cache_size`, :attr:`cache_entries`, :attr:`fingerprint`,
+        :attr:`stats_file`,
+        :attr:`match_timeout`, :attr:`reject_nested_repeats`, and
+        :attr:`profiles`. If
+        caching is enabled, the cache is pruned down to :attr:`cache_size`
+        and :attr:`cache_entries`, if it has not been for
+        :attr:`prune_interval`.
+        If statistics are enabled, the statistics file is truncated and a
+        summary is printed at exit. Finally, all of that is collected in
+        :attr:`config`.
         """
-        for option in ('author_re', 'copyright_re', 'license_re'):
-            regexes = cls._parse_option(options, option)
+        cls.reject_nested_repeats = bool(
+            getattr(options, 'ownership_reject_nested_repeats', False),
+        )
+        tags, year = [], cls.clock().year
+        for error, name in enumerate(cls.tags):
+            option = '%s_re' % name
+            regexes, matcher = cls._compile_option(options, option)
+            regexes = _fill_year(regexes, year)
             setattr(cls, option, [regex[1] for regex in regexes])
+            if matcher is not None:
+                code = '%s%i' % (cls.codes, error)
+                tags.append((name, code, matcher))
+        cls.plan = Plan(tags)
+        cls.max_lines = int(getattr(options, 'ownership_max_lines', 0) or 0)
+        cls.stop_at_docstring = bool(
+            getattr(options, 'ownership_stop_at_docstring', False),
+        )
+        cls.docstring_only = bool(
+            getattr(options, 'ownership_docstring_only', False),
+        )
+        cls.cache_dir = getattr(options, 'ownership_cache_dir', None) or None
+        cls.cache_size = int(
+            getattr(options, 'ownership_cache_size', 0) or 16 * 1024 * 1024,
+        )
+        cls.cache_entries = int(
+            getattr(options, 'ownership_cache_entries', 0) or 65536,
+        )
+        prefixes = cls._parse_prefixes(options)
+        cls.profiles = Profiles(prefixes)
+
+        cls.fingerprint = ''
+        cls.policies = None
+        path = getattr(options, 'ownership_policies', None) or None
+        if cls.cache_dir or path is not None:
+            parts = [
+                __version__,
+                str(cls.max_lines),
+                str(cls.stop_at_docstring),
+                str(cls.docstring_only),
+            ]
+            for extension, prefix in sorted(prefixes.items()):
+                parts.append('%s=%s' % (extension, prefix))
+            for tag in cls.plan.tags:
+                parts.append(tag.name)
+                parts.extend(tag.expected.patterns)
+            cls.fingerprint = _sha1('\0'.join(parts).encode('utf-8'))
+        if path is not None:
+            stat = os.stat(path)
+            key = (os.path.abspath(path), stat.st_mtime, stat.st_size,
+                   cls.fingerprint, cls.reject_nested_repeats)
+            cls.policies = policy_cache.get(key)
+            if cls.policies is None:
+                cls.policies = policy_cache[key] = cls._read_policies(path)
+
+        if cls.cache_dir:
+            cls._prune_cache()
+
+        cls.match_timeout = float(
+            getattr(options, 'ownership_match_timeout', 0) or 0,
+        )
+        cls.stats_file = getattr(options, 'ownership_stats', None) or None
+        # Pool workers may call this too; only the main process owns the
+        # statistics file and reports on it.
+        if cls.stats_file and _in_main_process():
+            open(cls.stats_file, 'w').close()
+            atexit.register(
+                print_stats,
+                cls.stats_file,
+                timeit.default_timer(),
+                sys.stderr,
+            )
+
+        cls.config = Config._make(getattr(cls, f) for f in Config._fields)
+
+    @classmethod
+    def configure(cls, config):
+        """
+        Install ``config``, as built by :meth:`parse_options`.
+
+        This is meant to be a process pool's initializer, so that workers
+        receive the configuration built in the main process rather than
+        building it again.
+
+        :param config: Configuration to install.
+        :type config: :class:`Config`
+        """
+        for name, value in zip(config._fields, config):
+            setattr(cls, name, value)
+        cls.config = config
+
+    @classmethod
+    def _read_policies(cls, path):
+        import argparse
+        config = configparser.RawConfigParser()
+        with open(path) as f:
+            if hasattr(config, 'read_file'):
+                config.read_file(f)
+            else:  # pragma: no cover (python 2)
+                config.readfp(f)
+        base = os.path.dirname(os.path.abspath(path))
+        policies = []
+        for section in config.sections():
+            values = {}
+            for key, value in config.items(section):
+                key = key.replace('-', '_')
+                if key in ('author_re', 'copyright_re', 'license_re'):
+                    values[key] = value
+            options = argparse.Namespace(**values)
+            tags, parts = [], [cls.fingerprint, section]
+            for error, name in enumerate(cls.tags):
+                option = '%s_re' % name
+                if option in values:
+                    expected = cls._compile_option(
+                        options,
+                        option,
+                        section,
+                    )[1]
+                else:
+                    tag = cls.plan.index.get(name)
+                    expected = None if tag is None else tag.expected
+                if expected is not None:
+                    code = '%s%i' % (cls.codes, error)
+                    tags.append((name, code, expected))
+                    parts.append(name)
+                    parts.extend(expected.patterns)
+            directory = os.path.join(base, *section.split('/'))
+            fingerprint = _sha1('\0'.join(parts).encode('utf-8'))
+            policies.append((directory, Plan(tags), fingerprint))
+        return PolicyIndex(policies)
 
-    def __init__(self, tree, filename):
-        """Initialize the checker; nothing special here."""
+    @classmethod
+    def _prune_cache(cls):
+        # Walking a large cache takes a while, so it is only done every
+        # prune_interval seconds, going by the mtime of a stamp file. The
+        # stamp is touched before walking, so that concurrent jobs do not
+        # all walk at once.
+        stamp = os.path.join(cls.cache_dir, 'pruned')
+        try:
+            if time.time() - os.stat(stamp).st_mtime < cls.prune_interval:
+                return
+        except OSError:
+            pass
+        try:
+            with open(stamp, 'a'):
+                os.utime(stamp, None)
+        except EnvironmentError:
+            # No cache directory yet, so nothing to prune.
+            return
+
+        entries, total = [], 0
+        for directory, _, filenames in os.walk(cls.cache_dir):
+            for filename in filenames:
+                path = os.path.join(directory, filename)
+                if path == stamp:
+                    continue
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+        entries.sort()
+        count = len(entries)
+        for _, size, path in entries:
+            if total <= cls.cache_size and count <= cls.cache_entries:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            count -= 1
+
+    def __init__(self, tree, filename, lines=None):
+        """
+        Initialize the checker.
+
+        flake8 hands over the ``lines`` it has already read (from disk or
+        from stdin), so the check does not need to reopen the file. If
+        ``lines`` is not supplied, the file at ``filename`` is read instead.
+        """
         self.filename = filename
+        self.lines = lines
         self.tree = tree
 
+        #: How tag lines look in the file.
+        #:
+        #: :type: :class:`Profile`
+        self.profile = self.profiles.lookup(filename)
+        if self.policies is not None:
+            policy = self.policies.lookup(filename)
+            if policy is not None:
+                self.plan, self.fingerprint = policy
+
+        #: Whether the result came from the cache (:data:`None` if caching
+        #: is disabled).
+        #:
+        #: :type: :class:`bool` or :data:`None`
+        self.cache_hit = None
+
+        #: Number of lines scanned, set once the scan has finished.
+        #:
+        #: :type: :class:`int`
+        self.scanned = 0
+
+        #: Number of regex matches attempted, set once the scan has finished.
+        #:
+        #: :type: :class:`int`
+        self.regex_calls = 0
+
+        #: Map of tag name to the value found for it, for the tags whose
+        #: value was not recognized or timed out (:data:`None` if there were
+        #: none).
+        #:
+        #: :type: :class:`dict` or :data:`None`
+        self.values = None
+
     def run(self):
         """Run the :class:`Checker` on a :attr:`filename`."""
-        tags = []
-        if self.author_re:
-            tags.append(dict(
-                name='author',
-                error='0',
-                re=author_re,
-                expected=self.author_re,
-            ))
-        if self.copyright_re:
-            tags.append(dict(
-                name='copyright',
-                error='1',
-                re=copyright_re,
-                expected=self.copyright_re,
-            ))
-        if self.license_re:
-            tags.append(dict(
-                name='license',
-                error='2',
-                re=license_re,
-                expected=self.license_re,
-            ))
-
-        with open(self.filename) as f:
-            i = 0
-            for line in f:
-                i += 1
-                line = line[:-1]
-                found_tag = None
-                for tag in tags:
-                    match = tag['re'].search(line)
-                    if match:
-                        found_tag = tag
-                        value = match.groupdict()[tag['name']]
-                        for regex in tag['expected']:
-                            if regex.search(value):
-                                break
-                        else:
-                            msg = '%s%s unrecognized %s' % (
-                                self.codes,
-                                tag['error'],
-                                tag['name'],
-                            )
-                            yield i, 0, msg, type(self)
-                        break
-                if found_tag:
-                    tags.remove(found_tag)
-                    if len(tags) == 0:
+        if not self.plan.mask:
+            # Nothing is configured, so there is no need to read the file.
+            return
+        if self.stats_file:
+            start = timeit.default_timer()
+        # In docstring-only mode, nothing is read, so there is nothing worth
+        # caching.
+        docstring = self.docstring_only and self.tree is not None
+        if self.cache_dir and not docstring:
+            errors = self._run_cached()
+        else:
+            errors = self._check(self._find())
+        for line, column, msg in errors:
+            yield line, column, msg, type(self)
+        if self.stats_file:
+            self._record_stats(timeit.default_timer() - start)
+
+    def _record_stats(self, seconds):
+        record = [
+            self.filename,
+            seconds,
+            self.scanned,
+            self.regex_calls,
+            self.cache_hit,
+        ]
+        record = (json.dumps(record) + '\n').encode('utf-8')
+        # A single write with O_APPEND, so records from concurrent flake8
+        # jobs do not interleave.
+        flags = os.O_WRONLY | os.O_APPEND | os.O_CREAT
+        fd = os.open(self.stats_file, flags, 0o644)
+        try:
+            os.write(fd, record)
+        finally:
+            os.close(fd)
+
+    def find_tags(self):
+        """
+        Return the configured tags found in the file, without checking them.
+
+        This scans the same part of the file, in the same way, as :meth:`run`
+        (but never uses the cache).
+
+        :return: Map of tag name to ``(line, value)``, for the tags that were
+                 found.
+        :rtype: :class:`dict`
+        """
+        if not self.plan.mask:
+            return {}
+        return dict((tag.name, (i, value)) for i, tag, value in self._find())
+
+    def _find(self):
+        if self.docstring_only and self.tree is not None:
+            return self._scan_docstring()
+        limit = self._limit()
+        if self.lines is not None:
+            return self._scan_lines(self.lines, limit)
+        with open(self.filename, 'rb') as f:
+            if limit is not None:
+                # Only read as much of the file as will be scanned.
+                return self._find_in_buffer(
+                    b''.join(itertools.islice(f, limit)),
+                )
+            import mmap
+            try:
+                buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (EnvironmentError, ValueError):
+                # Empty file, or not something that can be mapped.
+                return self._find_in_buffer(f.read())
+        try:
+            return self._find_in_buffer(buf)
+        finally:
+            buf.close()
+
+    def _cache_key(self, limit):
+        # Return (key, content), where content is what to check on a miss
+        # (None to read the file then). Only what will be scanned is read
+        # and hashed. Without a limit that would be the whole file, so a
+        # file flake8 has not read is keyed on its size and mtime instead.
+        content = None
+        if self.lines is not None:
+            lines = self.lines if limit is None else self.lines[:limit]
+            data = ''.join(lines)
+            if not isinstance(data, bytes):
+                data = data.encode('utf-8', 'surrogatepass')
+        elif limit is not None:
+            with open(self.filename, 'rb') as f:
+                content = data = b''.join(itertools.islice(f, limit))
+        else:
+            stat = os.stat(self.filename)
+            data = repr((
+                os.path.abspath(self.filename),
+                stat.st_ino,
+                stat.st_size,
+                getattr(stat, 'st_mtime_ns', stat.st_mtime),
+            )).encode('utf-8')
+        # The fingerprint does not change with the year, but the results
+        # for <YEAR> do. The same content can hold different tags depending
+        # on the file's comment prefix, which goes by its extension.
+        year = str(self.clock().year).encode('ascii')
+        key = b'\0'.join((
+            self.fingerprint.encode('ascii'),
+            year,
+            self.profile.prefix.encode('utf-8'),
+            data,
+        ))
+        return _sha1(key), content
+
+    def _run_cached(self):
+        limit = self._limit()
+        key, content = self._cache_key(limit)
+        path = os.path.join(self.cache_dir, key[:2], key)
+
+        try:
+            with open(path) as f:
+                entry = json.load(f)
+                mtime = os.fstat(f.fileno()).st_mtime
+            errors = [tuple(error) for error in entry['errors']]
+            self.values = entry['values']
+            # Bump the mtime, which is what eviction is based on. Pruning
+            # only happens every prune_interval, so bumping it more often
+            # than that would make no difference.
+            if time.time() - mtime > self.prune_interval:
+                os.utime(path, None)
+            self.cache_hit = True
+            return errors
+        except (IOError, OSError, KeyError, TypeError, ValueError):
+            pass
+
+        self.cache_hit = False
+        if content is not None:
+            errors = self._check_buffer(content)
+        else:
+            errors = list(self._check(self._find()))
+        timeouts = set(tag.timeout for tag in self.plan.tags)
+        if any(msg in timeouts for _, _, msg in errors):
+            # Timing out depends on the machine, not just on the file.
+            return errors
+        directory = os.path.dirname(path)
+        tmp = None
+        try:
+            if not os.path.isdir(directory):
+                try:
+                    os.makedirs(directory)
+                except OSError:
+                    # Another flake8 job may have just created it.
+                    if not os.path.isdir(directory):
+                        raise
+            import tempfile
+            fd, tmp = tempfile.mkstemp(dir=directory)
+            with os.fdopen(fd, 'w') as f:
+                json.dump(dict(errors=errors, values=self.values), f)
+            # Atomic, so concurrent jobs never read a partial entry.
+            os.rename(tmp, path)
+        except (IOError, OSError) as e:
+            LOG.debug('could not cache results for %s: %s', self.filename, e)
+            if tmp is not None and os.path.exists(tmp):
+                os.remove(tmp)
+        return errors
+
+    def check_content(self, content):
+        """
+        Check the raw ``content`` of the file, rather than reading it.
+
+        :param bytes content: Content of the file (or at least as much of the
+                              start of it as will be scanned).
+        :return: List of errors, as ``(line, column, message)`` tuples.
+        :rtype: :class:`list`
+        """
+        if not self.plan.mask:
+            return []
+        if self.docstring_only and self.tree is not None:
+            return list(self._check(self._scan_docstring()))
+        return self._check_buffer(_head(content, self._limit()))
+
+    def _limit(self):
+        limits = []
+        if self.max_lines > 0:
+            limits.append(self.max_lines)
+        if self.stop_at_docstring and getattr(self.tree, 'body', None):
+            node = self.tree.body[0]
+            if ast.get_docstring(self.tree, clean=False) is None:
+                # No docstring, so the header is whatever precedes the
+                # first statement (comments, encoding cookie, etc).
+                limits.append(node.lineno - 1)
+            else:
+                # Python < 3.8 reports the *last* line of a multi-line
+                # string as its lineno and has no end_lineno.
+                node = node.value
+                limits.append(getattr(node, 'end_lineno', None) or node.lineno)
+        if limits:
+            return min(limits)
+        return None
+
+    def _check_buffer(self, buf):
+        return list(self._check(self._find_in_buffer(buf)))
+
+    def _find_in_buffer(self, buf):
+        # Only the captured values are decoded, using the encoding from the
+        # PEP 263 declaration if there is one. The buffer may be a memory
+        # map that is about to be closed, so the scan runs to completion.
+        encoding = _encoding(buf[:1024].split(b'\n', 2)[:2])
+        return list(self._scan_buffer(buf, encoding))
+
+    def _scan_buffer(self, buf, encoding):
+        wanted, index = self.plan.mask, self.plan.index
+        needle, tag_re = self.profile.needle, self.profile.buffer_re
+        i, position, calls, end = 1, 0, 0, len(buf)
+        # Jump from line to line with find(), which is much faster than
+        # letting the regex engine try a match at every offset.
+        start = 0
+        if buf[:len(needle) - 1] != needle[1:]:
+            start = buf.find(needle) + 1 or end
+        while start < end:
+            calls += 1
+            match = tag_re.match(buf, start)
+            if match is not None:
+                tag = index.get(match.group('tag').decode('ascii'))
+                if tag is not None and wanted & tag.bit:
+                    wanted ^= tag.bit
+                    i += buf[position:start].count(b'\n')
+                    position = start
+                    value = match.group('value').decode(encoding, 'replace')
+                    yield i, tag, value
+                    if not wanted:
                         break
-        for tag in tags:
-            msg = '%s%s missing %s' % (self.codes, tag['error'], tag['name'])
-            yield 0, 0, msg, type(self)
+            start = buf.find(needle, start) + 1 or end
+        self.regex_calls += calls
+        if self.stats_file and wanted:
+            # Scanned to the end, so count the rest of the lines.
+            rest = buf[position:]
+            partial = 1 if rest and not rest.endswith(b'\n') else 0
+            self.scanned = i - 1 + rest.count(b'\n') + partial
+        elif self.stats_file:
+            self.scanned = i
+
+    def _scan_docstring(self):
+        docstring = None
+        if getattr(self.tree, 'body', None):
+            docstring = ast.get_docstring(self.tree, clean=False)
+        if docstring is None:
+            self.scanned = 0
+            return iter(())
+        node = self.tree.body[0].value
+        if getattr(node, 'end_lineno', None) is None:
+            # Python < 3.8 reports the last line of the string as its lineno.
+            offset = node.lineno - docstring.count('\n') - 1
+        else:
+            offset = node.lineno - 1
+        lines = docstring.splitlines(True)
+        # Tags in a docstring are bare, whatever the file's profile.
+        found = self._scan_lines(lines, None, self.profiles.default)
+        return ((i + offset, tag, value) for i, tag, value in found)
+
+    def _scan_lines(self, lines, limit, profile=None):
+        wanted, index = self.plan.mask, self.plan.index
+        profile = profile or self.profile
+        start, tag_re = profile.start, profile.line_re
+        i, calls = 0, 0
+        for line in itertools.islice(lines, limit):
+            i += 1
+            if not line.startswith(start):
+                continue
+            calls += 1
+            match = tag_re.match(line.rstrip('\r\n'))
+            if match is None:
+                continue
+            tag = index.get(match.group('tag'))
+            if tag is None or not wanted & tag.bit:
+                continue
+            wanted ^= tag.bit
+            yield i, tag, match.group('value')
+            if not wanted:
+                break
+        self.scanned = i
+        self.regex_calls += calls
+
+    def _match(self, found):
+        # Return the index of the matching regex for each found value. If
+        # matching runs out of time, the list stops short at the value that
+        # was being matched.
+        if self.match_timeout <= 0 or \
+                not any(tag.expected.searches for _, tag, _ in found):
+            return [tag.expected.search(value) for _, tag, value in found]
+        rv = []
+
+        def match():
+            for _, tag, value in found:
+                rv.append(tag.expected.search(value))
+
+        try:
+            _with_timeout(self.match_timeout, match)
+        except _MatchTimeout:
+            pass
+        return rv
+
+    def _check(self, found):
+        missing = self.plan.mask
+        # The values are all matched up front, so that the time limit only
+        # covers matching (not scanning, or whoever consumes the errors).
+        found = list(found)
+        indexes = self._match(found)
+        self.regex_calls += len(found)
+        for n, (i, tag, value) in enumerate(found):
+            missing ^= tag.bit
+            if n >= len(indexes):
+                if self.values is None:
+                    self.values = {}
+                self.values[tag.name] = value
+                yield i, 0, tag.timeout
+                continue
+            index = indexes[n]
+            if index is None:
+                if self.values is None:
+                    self.values = {}
+                self.values[tag.name] = value
+                yield i, 0, tag.unrecognized
+            else:
+                LOG.debug(
+                    '%s:%i: %s matched %r',
+                    self.filename,
+                    i,
+                    tag.name,
+                    tag.expected.patterns[index],
+                )
+        if missing:
+            for tag in self.plan.tags:
+                if missing & tag.bit:
+                    yield 0, 0, tag.missing
+
+
+def _sha1(data):
+    # hashlib loads OpenSSL, which is slow enough to show up in flake8's
+    # startup time, so it is only imported when something is hashed.
+    import hashlib
+    return hashlib.sha1(data).hexdigest()
+
+
+def _encoding(lines):
+    # The PEP 263 declaration may be on either of the first two lines.
+    for line in lines:
+        match = coding_re.match(line)
+        if match is not None:
+            try:
+                coding = match.group('coding').decode('ascii')
+                return codecs.lookup(coding).name
+            except LookupError:
+                pass
+            break
+    return 'utf-8'
+
+
+def _head(content, limit):
+    # Return the first limit lines of content (all of it if limit is None).
+    if limit is not None:
+        end = 0
+        for _ in range(limit):
+            end = content.find(b'\n', end) + 1
+            if end == 0:
+                break
+        else:
+            return content[:end]
+    return content
+
+
+def print_stats(path, start, stream):
+    """
+    Print a summary of the statistics recorded in ``path``.
+
+    The statistics are recorded by :meth:`Checker.run` (in whichever process
+    checks the file) when :attr:`Checker.stats_file` is set.
+
+    :param str path: Path to the statistics file.
+    :param float start: Time (per :func:`timeit.default_timer`) at which
+                        the run started.
+    :param stream: File-like object to which the summary is written.
+    """
+    elapsed = timeit.default_timer() - start
+    records = []
+    with open(path) as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                continue
+    if not records:
+        stream.write('flake8-ownership: no files checked\n')
+        return
+
+    times = sorted(record[1] for record in records)
+    total = sum(times)
+
+    def percentile(p):
+        return times[int(round(p * (len(times) - 1)))]
+
+    hits = sum(1 for record in records if record[4] is True)
+    misses = sum(1 for record in records if record[4] is False)
+    write = stream.write
+    write('flake8-ownership statistics\n')
+    write('  files checked: %i\n' % len(records))
+    write('  lines scanned: %i\n' % sum(record[2] for record in records))
+    write('  regex calls:   %i\n' % sum(record[3] for record in records))
+    if hits or misses:
+        write('  cache:         %i hits, %i misses\n' % (hits, misses))
+    write('  time per file: p50 %.3fms, p95 %.3fms, max %.3fms\n' % (
+        percentile(0.5) * 1000,
+        percentile(0.95) * 1000,
+        times[-1] * 1000,
+    ))
+    write('  total time:    %.3fs in checks (all processes), %.3fs elapsed '
+          '(%.1f%%)\n' % (total, elapsed, 100.0 * total / (elapsed or 1)))
+    write('  slowest files:\n')
+    records.sort(key=lambda record: record[1], reverse=True)
+    for record in records[:10]:
+        write('    %8.3fms  %s\n' % (record[1] * 1000, record[0]))
@@ -0,0 +1,1514 @@
+# -*- coding: utf-8 -*-
+"""
+Standalone scanner for flake8-ownership, the ``flake8-ownership`` command.
+
+:author: Joe Joyce <joe@decafjoe.com>
+:copyright: Copyright (c) Joe Joyce and contributors, 2016-2019.
+:license: BSD
+
+This is kept apart from the flake8 extension, so that flake8 does not load
+the scanner, the daemon, and everything they import on every run.
+"""
+import argparse
+import array
+import ast
+import bisect
+import collections
+import fnmatch
+import functools
+import itertools
+import json
+import multiprocessing
+import os
+import re
+import select
+import shutil
+import signal
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+
+try:
+    import configparser
+except ImportError:  # pragma: no cover (python 2)
+    import ConfigParser as configparser  # noqa: N813
+
+from flake8_ownership import __version__, _encoding, _head, _MatchTimeout, \
+    _search, _with_timeout, batch_tag_re, Checker, LOG, OptionError
+
+
+#: Regex that matches a year, or a range of years, in a copyright value.
+#:
+#: :type: :func:`re <re.compile>`
+year_re = re.compile(
+    r'(?<!\d)(?P<first>\d{4})(?:(?P<sep>\s*-\s*)(?P<last>\d{4}))?(?!\d)',
+)
+
+
+#: Configuration files searched (in order) by the standalone scanner.
+#:
+#: :type: :class:`tuple` of :class:`str`
+config_files = ('setup.cfg', 'tox.ini', '.flake8')
+
+
+#: Default value for ``--exclude`` in the standalone scanner (the same as
+#: flake8's).
+#:
+#: :type: :class:`str`
+default_exclude = '.svn,CVS,.bzr,.hg,.git,__pycache__,.tox,.eggs,*.egg'
+
+
+#: Regex that matches a hunk header in ``git diff -U0`` output, capturing
+#: the line where the new side of the hunk starts.
+#:
+#: :type: :func:`re <re.compile>`
+hunk_re = re.compile(r'^@@ -\d+(?:,\d+)? \+(?P<start>\d+)(?:,\d+)? @@')
+
+
+def fix_copyright(value, year=None, plan=None):
+    """
+    Return ``value`` with its (last) year brought up to date, if that fixes it.
+
+    A copyright value goes stale when a ``<YEAR>`` in the configured regexes
+    rolls over. This tries, in order: moving the end of a year range to
+    ``year`` (``2016-2019`` to ``2016-2020``), turning a single year into a
+    range ending in ``year`` (``2016`` to ``2016-2020``), and replacing a
+    single year with ``year``. The first candidate that matches the
+    configured ``:copyright:`` regexes is returned.
+
+    :param str value: Current value of the ``:copyright:`` tag.
+    :param int year: Year to update to (and that ``<YEAR>`` stands for),
+                     defaults to the current year per
+                     :attr:`~flake8_ownership.Checker.clock`.
+    :param plan: Configured tags, defaults to
+                 :attr:`~flake8_ownership.Checker.plan`.
+    :type plan: :class:`~flake8_ownership.Plan` or :data:`None`
+    :return: Fixed value, or :data:`None` if ``value`` is already valid or
+             could not be fixed (which includes matching taking longer than
+             :attr:`~flake8_ownership.Checker.match_timeout`).
+    :rtype: :class:`str` or :data:`None`
+    """
+    tag = (plan or Checker.plan).index.get('copyright')
+    if year is None:
+        year = Checker.clock().year
+    try:
+        return _fix_copyright(value, year, tag)
+    except _MatchTimeout:
+        return None
+
+
+def _fix_copyright(value, year, tag):
+    if tag is None or _search(tag.expected, value, year) is not None:
+        return None
+    matches = list(year_re.finditer(value))
+    if not matches:
+        return None
+    text = str(year)
+    match = matches[-1]
+    start, end = match.span()
+    first = match.group('first')
+    if match.group('last') is None:
+        years = ('%s-%s' % (first, text), text)
+    else:
+        years = (first + match.group('sep') + text,)
+    for replacement in years:
+        candidate = value[:start] + replacement + value[end:]
+        if candidate != value and \
+                _search(tag.expected, candidate, year) is not None:
+            return candidate
+    return None
+
+
+def fix(path, dry_run=False):
+    """
+    Rewrite a stale ``:copyright:`` line in ``path`` per :func:`fix_copyright`.
+
+    Lines are read up to the first ``:copyright:`` line (within
+    :attr:`~flake8_ownership.Checker.max_lines`), without holding them in
+    memory. If it needs fixing, the file is copied in blocks, with the fixed
+    line, into a temporary file that then atomically replaces ``path``.
+    Nothing is written if the line does not need (or cannot be) fixed.
+
+    :param str path: Path to the file.
+    :param bool dry_run: Work out the fix, but do not write it.
+    :return: ``(line, old, new)`` tuple, where ``line`` is the line number
+             and ``old`` and ``new`` are the lines (without line endings),
+             or :data:`None` if nothing was (or would be) changed.
+    :rtype: :class:`tuple` or :data:`None`
+    """
+    profile = Checker.profiles.lookup(path)
+    start = profile.needle[1:]
+    with open(path, 'rb') as f:
+        first, offset = [], 0
+        limit = Checker.max_lines or None
+        for i, line in enumerate(itertools.islice(f, limit), 1):
+            if i <= 2:
+                first.append(line)
+            offset += len(line)
+            if not line.startswith(start):
+                continue
+            match = profile.buffer_re.match(line)
+            if match is None or match.group('tag') != b'copyright':
+                continue
+            encoding = _encoding(first)
+            try:
+                value = match.group('value').decode(encoding)
+                value = fix_copyright(value, plan=Checker(None, path).plan)
+                if value is None:
+                    return None
+                value = value.encode(encoding)
+            except UnicodeError:
+                return None
+            start, end = match.span('value')
+            fixed = line[:start] + value + line[end:]
+            break
+        else:
+            return None
+
+        rv = (
+            i,
+            line.rstrip(b'\r\n').decode(encoding),
+            fixed.rstrip(b'\r\n').decode(encoding),
+        )
+        if dry_run:
+            return rv
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path) or os.curdir)
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                # Only the header was read line by line; copy it and the rest
+                # of the file in blocks.
+                f.seek(0)
+                out.write(f.read(offset - len(line)))
+                out.write(fixed)
+                f.seek(offset)
+                shutil.copyfileobj(f, out)
+            shutil.copymode(path, tmp)
+            os.rename(tmp, path)
+        except BaseException:
+            os.remove(tmp)
+            raise
+    return rv
+
+
+class Reporter(object):
+    """
+    Write errors from the standalone scanner in flake8's default format.
+
+    Subclasses write other formats. Errors are written as they are reported,
+    so nothing accumulates in memory however many there are.
+
+    :param stream: File-like object to which the errors are written.
+    """
+
+    def __init__(self, stream):
+        """Initialize the reporter."""
+        self.stream = stream
+
+    def start(self):
+        """Write whatever comes before the first error."""
+
+    def report(self, path, error, values):
+        """
+        Write an error.
+
+        :param str path: Path of the file.
+        :param tuple error: ``(line, column, message)`` tuple, as returned
+                            from
+                            :meth:`~flake8_ownership.Checker.check_content`.
+        :param dict values: Unrecognized values found in the file, as in
+                            :attr:`~flake8_ownership.Checker.values`.
+        """
+        line, column, msg = error
+        self.stream.write('%s:%i:%i: %s\n' % (path, line, column + 1, msg))
+
+    def finish(self):
+        """Write whatever comes after the last error."""
+
+    def record(self, path, error, values):
+        """
+        Return the details of an error as a :class:`dict`.
+
+        :param str path: Path of the file.
+        :param tuple error: ``(line, column, message)`` tuple.
+        :param dict values: Unrecognized values found in the file.
+        :return: Dictionary with ``path``, ``line``, ``column`` (starting from
+                 ``1``), ``code``, ``tag``, ``option`` (the option with the
+                 regexes that were tried), ``value`` (:data:`None` if the tag
+                 is missing), and ``message`` keys.
+        :rtype: :class:`dict`
+        """
+        line, column, msg = error
+        code = msg.split(' ', 1)[0]
+        # Every message ends with the name of the tag.
+        name = msg.rsplit(' ', 1)[-1]
+        if name not in Checker.tags:
+            name = None
+        return dict(
+            code=code,
+            column=column + 1,
+            line=line,
+            message=msg,
+            option=None if name is None else '%s_re' % name,
+            path=path,
+            tag=name,
+            value=values.get(name),
+        )
+
+
+class JSONLinesReporter(Reporter):
+    """Write each error as a line of JSON (see :meth:`Reporter.record`)."""
+
+    def report(self, path, error, values):
+        """Write the error as a line of JSON."""
+        record = self.record(path, error, values)
+        self.stream.write(json.dumps(record, sort_keys=True) + '\n')
+
+
+class SARIFReporter(Reporter):
+    """
+    Write the errors as a `SARIF`_ 2.1.0 log.
+
+    The log is a single JSON document, but it is still written incrementally:
+    the results are streamed out between the head and the tail of the
+    document. The other details from :meth:`Reporter.record` are included in
+    the ``properties`` of each result.
+
+    .. _SARIF: https://docs.oasis-open.org/sarif/sarif/v2.1.0/sarif-v2.1.0.html
+    """
+
+    def start(self):
+        """Write the head of the document, up to the list of results."""
+        plans = [Checker.plan]
+        if Checker.policies is not None:
+            plans.extend(plan for _, plan, _ in Checker.policies.policies)
+        tags = {}
+        for plan in plans:
+            tags.update((tag.code, tag) for tag in plan.tags)
+        rules = []
+        for _, tag in sorted(tags.items()):
+            rules.append({
+                'id': tag.code,
+                'name': '%s-tag' % tag.name,
+                'shortDescription': {
+                    'text': 'Missing or unrecognized %s' % tag.name,
+                },
+            })
+        if tags and Checker.match_timeout > 0:
+            rules.append({
+                'id': '%s3' % Checker.codes,
+                'name': 'match-timeout',
+                'shortDescription': {
+                    'text': 'Matching a tag took too long',
+                },
+            })
+        placeholder = '@results@'
+        document = {
+            '$schema': 'https://json.schemastore.org/sarif-2.1.0.json',
+            'version': '2.1.0',
+            'runs': [{
+                'tool': {
+                    'driver': {
+                        'name': 'flake8-ownership',
+                        'version': __version__,
+                        'rules': rules,
+                    },
+                },
+                'results': placeholder,
+            }],
+        }
+        document = json.dumps(document, sort_keys=True)
+        head, self.tail = document.split('"%s"' % placeholder)
+        self.stream.write(head + '[')
+        self.separator = '\n'
+
+    def report(self, path, error, values):
+        """Write the error as a SARIF result."""
+        record = self.record(path, error, values)
+        uri = path.replace(os.sep, '/')
+        if os.path.isabs(path):
+            uri = 'file://' + ('' if uri.startswith('/') else '/') + uri
+        location = {'artifactLocation': {'uri': uri}}
+        if record['line']:
+            location['region'] = {
+                'startColumn': record['column'],
+                'startLine': record['line'],
+            }
+        result = {
+            'level': 'error',
+            'locations': [{'physicalLocation': location}],
+            'message': {'text': record['message']},
+            'properties': dict(
+                option=record['option'],
+                tag=record['tag'],
+                value=record['value'],
+            ),
+            'ruleId': record['code'],
+        }
+        self.stream.write(self.separator + json.dumps(result, sort_keys=True))
+        self.separator = ',\n'
+
+    def finish(self):
+        """Write the tail of the document."""
+        self.stream.write('\n]' + self.tail + '\n')
+
+
+class Inventory(object):
+    """
+    Counts of the tag values found across files, for ``--report``.
+
+    Only the counts are kept, so memory use depends on the number of
+    distinct values, not the number of files.
+    """
+
+    def __init__(self):
+        """Start with no files."""
+        #: Number of files counted.
+        #:
+        #: :type: :class:`int`
+        self.files = 0
+
+        #: Map of tag name to a map of value (:data:`None` for files where
+        #: the tag is missing) to a ``[files, unrecognized]`` list, where
+        #: ``unrecognized`` is the number of those files where the value was
+        #: not valid.
+        #:
+        #: :type: :class:`dict`
+        self.tags = {}
+
+    def add(self, found):
+        """
+        Count a file.
+
+        :param found: ``(tag, value, valid)`` tuples for each tag configured
+                      for the file, where ``value`` is :data:`None` if the
+                      tag is missing.
+        :type found: iterable
+        """
+        self.files += 1
+        for name, value, valid in found:
+            values = self.tags.setdefault(name, {})
+            counts = values.get(value)
+            if counts is None:
+                counts = values[value] = [0, 0]
+            counts[0] += 1
+            if not valid and value is not None:
+                counts[1] += 1
+
+    def summary(self):
+        """
+        Return the counts, with the most common values first.
+
+        :return: Dictionary with the number of ``files`` and, under ``tags``,
+                 a list of ``{value, files, unrecognized}`` dictionaries for
+                 each tag.
+        :rtype: :class:`dict`
+        """
+        tags = {}
+        for name, values in self.tags.items():
+            rows = sorted(
+                values.items(),
+                key=lambda item: (-item[1][0], item[0] is None, item[0]),
+            )
+            tags[name] = [
+                dict(value=value, files=files, unrecognized=unrecognized)
+                for value, (files, unrecognized) in rows
+            ]
+        return dict(files=self.files, tags=tags)
+
+    def write_table(self, stream):
+        """
+        Write the counts as a table.
+
+        :param stream: File-like object to which the table is written.
+        """
+        summary = self.summary()
+        stream.write('%i files\n' % summary['files'])
+        for name in Checker.tags:
+            rows = summary['tags'].get(name)
+            if rows is None:
+                continue
+            stream.write('\n%s\n    files  unrecognized  value\n' % name)
+            for row in rows:
+                value = row['value']
+                if value is None:
+                    value, unrecognized = '(missing)', '-'
+                else:
+                    unrecognized = str(row['unrecognized'])
+                stream.write('  %7i  %12s  %s\n' % (
+                    row['files'],
+                    unrecognized,
+                    value,
+                ))
+
+
+#: Map of ``--format`` name to :class:`Reporter` class, for the standalone
+#: scanner.
+#:
+#: :type: :class:`dict`
+reporters = {
+    'default': Reporter,
+    'jsonl': JSONLinesReporter,
+    'sarif': SARIFReporter,
+}
+
+
+class _OptionParser(object):
+    """Adapts :meth:`~flake8_ownership.Checker.add_options` for argparse."""
+
+    def __init__(self, parser):
+        """Wrap ``parser``."""
+        self.parser = parser
+        self.config_actions = {}
+        self.paths = set()
+
+    def add_option(self, *args, **kwargs):
+        """Add the flake8-style option to the :mod:`argparse` parser."""
+        from_config = kwargs.pop('parse_from_config', False)
+        normalize_paths = kwargs.pop('normalize_paths', False)
+        if kwargs.get('type') in ('int', 'float'):
+            kwargs['type'] = dict(int=int, float=float)[kwargs['type']]
+        action = self.parser.add_argument(*args, **kwargs)
+        if from_config:
+            self.config_actions[action.dest] = action
+        if normalize_paths:
+            self.paths.add(action.dest)
+
+    def read_config(self, path):
+        """
+        Set defaults from the ``[flake8]`` section of the config at ``path``.
+
+        :param str path: Path to the configuration file.
+        """
+        config = configparser.RawConfigParser()
+        config.read(path)
+        if not config.has_section('flake8'):
+            return
+        defaults = {}
+        for key, value in config.items('flake8'):
+            dest = key.replace('-', '_')
+            action = self.config_actions.get(dest)
+            if action is None:
+                continue
+            if action.nargs == 0:
+                value = value.strip().lower() in ('1', 'on', 'true', 'yes')
+            elif action.type is not None:
+                value = action.type(value)
+            elif dest in self.paths:
+                # Relative to the config file, like flake8 does.
+                value = os.path.join(os.path.dirname(path), value.strip())
+            defaults[dest] = value
+        self.parser.set_defaults(**defaults)
+
+
+def _excluded(path, patterns):
+    path = os.path.normpath(path)
+    if any(fnmatch.fnmatch(path, pattern) for pattern in patterns):
+        return True
+    while path and path not in (os.curdir, os.sep):
+        path, name = os.path.split(path)
+        if any(fnmatch.fnmatch(name, pattern) for pattern in patterns):
+            return True
+    return False
+
+
+def _find_files(paths, exclude):
+    patterns = [p.strip() for p in exclude.split(',') if p.strip()]
+    for path in paths:
+        if _excluded(path, patterns):
+            continue
+        if not os.path.isdir(path):
+            yield path
+            continue
+        for directory, dirnames, filenames in os.walk(path):
+            dirnames[:] = sorted(
+                d for d in dirnames
+                if not _excluded(os.path.join(directory, d), patterns)
+            )
+            for filename in sorted(filenames):
+                path = os.path.join(directory, filename)
+                if Checker.profiles.wanted(path) and \
+                        not _excluded(path, patterns):
+                    yield path
+
+
+def _find_changed_files(paths, exclude, base, header_lines):
+    """
+    Return the files under ``paths`` that changed since ``base``.
+
+    This asks git for the diff between ``base`` and the working tree, with
+    no context lines. If ``header_lines`` is given, files where none of the
+    hunks start within the first ``header_lines`` lines are skipped, since
+    their tags cannot have changed.
+    """
+    command = [
+        'git',
+        '-c',
+        'core.quotepath=off',
+        'diff',
+        '--no-color',
+        '--no-ext-diff',
+        '--diff-filter=d',
+        '--relative',
+        '-U0',
+        base,
+        '--',
+    ]
+    output = subprocess.check_output(command + list(paths))
+    output = output.decode(sys.getfilesystemencoding() or 'utf-8')
+
+    patterns = [p.strip() for p in exclude.split(',') if p.strip()]
+    rv, path = [], None
+    for line in output.splitlines():
+        if line.startswith('+++ '):
+            path = line[6:] if line.startswith('+++ b/') else None
+            if not path or not Checker.profiles.wanted(path):
+                path = None
+            elif _excluded(path, patterns):
+                path = None
+            elif header_lines is None:
+                rv.append(path)
+                path = None
+            continue
+        match = hunk_re.match(line)
+        if path is not None and match:
+            if int(match.group('start')) <= header_lines:
+                rv.append(path)
+                path = None
+    return rv
+
+
+def _parse_file(path):
+    if Checker.stop_at_docstring or Checker.docstring_only:
+        try:
+            with open(path) as f:
+                return ast.parse(f.read())
+        except (SyntaxError, ValueError):
+            pass
+    return None
+
+
+def _run_file(path):
+    checker = Checker(_parse_file(path), path)
+    errors = [error[:3] for error in checker.run()]
+    return path, errors, checker.values or {}
+
+
+def _unreadable(path, e):
+    # Report a file that could not be read the way flake8 does, so that one
+    # bad file (e.g. a dangling symlink) does not stop the scan.
+    return path, [(0, 0, 'E902 %s: %s' % (type(e).__name__, e))], {}
+
+
+def _check_file(path):
+    try:
+        return _run_file(path)
+    except EnvironmentError as e:
+        return _unreadable(path, e)
+
+
+def _inventory_file(path):
+    # Return (path, found, errors), where errors holds the E902 error if the
+    # file could not be read (and found is then None).
+    try:
+        checker = Checker(_parse_file(path), path)
+        found = checker.find_tags()
+    except EnvironmentError as e:
+        return path, None, _unreadable(path, e)[1]
+    rv = []
+    for tag in checker.plan.tags:
+        _, value = found.get(tag.name, (0, None))
+        valid = False
+        if value is not None:
+            try:
+                valid = _search(tag.expected, value) is not None
+            except _MatchTimeout:
+                # Not known to be valid, so counted as unrecognized.
+                pass
+        rv.append((tag.name, value, valid))
+    return path, rv, []
+
+
+def _fix_file(path, dry_run):
+    # Return (path, change, errors), like _inventory_file.
+    try:
+        return path, fix(path, dry_run), []
+    except EnvironmentError as e:
+        return path, None, _unreadable(path, e)[1]
+
+
+def _read_header(path):
+    with open(path, 'rb') as f:
+        parse = Checker.stop_at_docstring or Checker.docstring_only
+        if Checker.max_lines and not parse:
+            return b''.join(itertools.islice(f, Checker.max_lines))
+        return f.read()
+
+
+def _check_content(path, content):
+    tree = None
+    if Checker.stop_at_docstring or Checker.docstring_only:
+        try:
+            tree = ast.parse(content)
+        except (SyntaxError, ValueError):
+            pass
+    checker = Checker(tree, path)
+    return path, checker.check_content(content), checker.values or {}
+
+
+class Batch(collections.namedtuple('Batch', (
+    'files',
+    'lines',
+    'codes',
+    'messages',
+    'values',
+))):
+    """
+    Errors found by :func:`check_headers`, as parallel sequences.
+
+    The ``i``-th error is in the header at index ``files[i]``, on line
+    ``lines[i]`` of it (``0`` if the tag is missing). Its error code is
+    ``codes[i]`` (e.g. ``102`` for ``O102``) and its message is
+    ``messages[i]``. ``values[i]`` is the value that was not recognized or
+    timed out, or :data:`None` if the tag is missing. The errors for each
+    header are in the same order as
+    :meth:`~flake8_ownership.Checker.check_content` returns them, and the
+    headers are in order.
+
+    ``files``, ``lines``, and ``codes`` are :class:`array.array` instances;
+    ``messages`` and ``values`` are lists of strings shared between errors.
+
+    :param files: Indexes of the headers with errors.
+    :param lines: Line numbers of the errors.
+    :param codes: Numbers of the error codes.
+    :param messages: Messages for the errors.
+    :param values: Values found for the tags.
+    """
+
+    __slots__ = ()
+
+
+def check_headers(headers, paths=None):
+    """
+    Check many pre-read headers at once.
+
+    Rather than scanning each header in turn, this joins them into a single
+    buffer and finds every tag in it with one pass of
+    :data:`~flake8_ownership.batch_tag_re` (or, with comment prefixes
+    configured, :attr:`~flake8_ownership.Profiles.batch_re`), mapping each
+    match back to its header by offset.
+    Each distinct value of a tag is matched against the regexes once, however
+    many headers it appears in. Like
+    :meth:`~flake8_ownership.Checker.check_content`, only the first
+    occurrence of each tag in a header counts, and headers are cut down to
+    ``ownership-max-lines`` if it is set. The docstring options need the
+    parsed file, so they do not apply.
+    :meth:`~flake8_ownership.Checker.parse_options` must have been called
+    first.
+
+    :param headers: Start of each file, as :class:`bytes`.
+    :type headers: :class:`list` of :class:`bytes`
+    :param paths: Paths of the files, in the same order, to look up the
+                  policy (see ``ownership-policies``) and
+                  :class:`~flake8_ownership.Profile` for each file.
+    :type paths: :class:`list` of :class:`str` or :data:`None`
+    :return: The errors.
+    :rtype: :class:`Batch`
+    """
+    files, lines, codes = array.array('l'), array.array('l'), array.array('H')
+    messages, values = [], []
+    default = Checker.plan
+    if not default.mask and Checker.policies is None:
+        return Batch(files, lines, codes, messages, values)
+    if Checker.max_lines > 0:
+        headers = [_head(header, Checker.max_lines) for header in headers]
+    plans = None
+    if paths is not None and Checker.policies is not None:
+        plans = []
+        for path in paths:
+            policy = Checker.policies.lookup(path)
+            plans.append(default if policy is None else policy[0])
+    profiles = Checker.profiles
+    prefixes = None
+    if profiles.batch_re is not batch_tag_re:
+        # The regex finds tag lines with any of the prefixes; each one is
+        # then checked against the prefix for its file.
+        prefixes = [profiles.default.prefix] * len(headers)
+        if paths is not None:
+            prefixes = [profiles.lookup(path).prefix for path in paths]
+        prefixes = [prefix.encode('utf-8') for prefix in prefixes]
+
+    # Each header starts after a newline, which also stops a value running
+    # from one header into the next.
+    buf = b'\n' + b'\n'.join(headers)
+    starts, offset = [], 1
+    for header in headers:
+        starts.append(offset)
+        offset += len(header) + 1
+
+    timeout = Checker.match_timeout
+    year = Checker.clock().year
+    results, encodings = {}, {}
+
+    def add(i, line, message, value):
+        files.append(i)
+        lines.append(line)
+        codes.append(int(message[1:message.index(' ')]))
+        messages.append(message)
+        values.append(value)
+
+    def finish(i, found):
+        # Report the tags missing from header i.
+        plan = default if plans is None else plans[i]
+        missing = plan.mask & ~found
+        if missing:
+            for tag in plan.tags:
+                if missing & tag.bit:
+                    add(i, 0, tag.missing, None)
+
+    current, found, plan = -1, 0, None
+    for match in profiles.batch_re.finditer(buf):
+        start = match.start() + 1
+        i = bisect.bisect_right(starts, start) - 1
+        if prefixes is not None and \
+                match.group('prefix').rstrip(b' \t') != prefixes[i]:
+            continue
+        if i != current:
+            if current >= 0:
+                finish(current, found)
+            for j in range(current + 1, i):
+                finish(j, 0)
+            current, found = i, 0
+            plan = default if plans is None else plans[i]
+        tag = plan.index.get(match.group('tag').decode('ascii'))
+        if tag is None or found & tag.bit:
+            continue
+        found |= tag.bit
+        raw = match.group('value')
+        key = (tag.expected, raw)
+        result = results.get(key, results)
+        if result is results:
+            try:
+                value = raw.decode('ascii')
+            except UnicodeDecodeError:
+                encoding = encodings.get(i)
+                if encoding is None:
+                    header = headers[i]
+                    encoding = _encoding(header[:1024].split(b'\n', 2)[:2])
+                    encodings[i] = encoding
+                value = raw.decode(encoding, 'replace')
+                # The value depends on the header's encoding, so it is not
+                # shared with other headers.
+                key = (tag.expected, raw, i)
+            if timeout > 0 and tag.expected.searches:
+                try:
+                    index = _with_timeout(
+                        timeout,
+                        tag.expected.search,
+                        value,
+                        year,
+                    )
+                    result = (value, index is not None)
+                except _MatchTimeout:
+                    result = (value, None)
+            else:
+                result = (value, tag.expected.search(value, year) is not None)
+            results[key] = result
+        value, valid = result
+        if not valid:
+            line = buf.count(b'\n', starts[i], start) + 1
+            add(i, line, tag.unrecognized if valid is False else tag.timeout,
+                value)
+    if current >= 0:
+        finish(current, found)
+    for j in range(current + 1, len(headers)):
+        finish(j, 0)
+    return Batch(files, lines, codes, messages, values)
+
+
+def _check_read(loop, path, future):
+    try:
+        content = loop.run_until_complete(future)
+    except EnvironmentError as e:
+        return _unreadable(path, e)
+    return _check_content(path, content)
+
+
+def scan(paths, concurrency=32, read=None):
+    """
+    Check ``paths``, keeping up to ``concurrency`` file reads in flight.
+
+    This is meant for filesystems where opening a file is slow (e.g. network
+    mounts), where checking one file at a time spends most of its time
+    waiting. The reads run on an :mod:`asyncio` event loop's executor, since
+    :mod:`asyncio` has no non-blocking file I/O of its own. The tags are
+    checked in the calling process with
+    :meth:`~flake8_ownership.Checker.check_content`, so
+    :meth:`~flake8_ownership.Checker.parse_options` must have been called
+    first.
+
+    :param paths: Paths of the files to check.
+    :type paths: iterable of :class:`str`
+    :param int concurrency: Maximum number of reads in flight.
+    :param read: Function that takes a path and returns the content of the
+                 file as :class:`bytes` (defaults to reading the file, or
+                 just the header window if there is one).
+    :return: Iterator of ``(path, errors, values)`` tuples, in the same
+             order as ``paths``, where ``errors`` is as returned from
+             :meth:`~flake8_ownership.Checker.check_content` (or a single
+             ``E902`` error if the file could not be read) and ``values`` is
+             :attr:`~flake8_ownership.Checker.values` (or an empty
+             :class:`dict`).
+    :rtype: iterator
+    """
+    # asyncio takes longer to import than the rest of the module put
+    # together, so it is only imported when it is used.
+    try:
+        import asyncio
+        import concurrent.futures
+    except ImportError:  # pragma: no cover (python 2)
+        raise RuntimeError('asyncio is not available')
+    if read is None:
+        read = _read_header
+    loop = asyncio.new_event_loop()
+    executor = concurrent.futures.ThreadPoolExecutor(concurrency)
+    pending = collections.deque()
+    try:
+        for path in paths:
+            pending.append((path, loop.run_in_executor(executor, read, path)))
+            if len(pending) >= concurrency:
+                # Results come back in order: wait for the oldest read, even
+                # if later ones are already done.
+                path, future = pending.popleft()
+                yield _check_read(loop, path, future)
+        while pending:
+            path, future = pending.popleft()
+            yield _check_read(loop, path, future)
+    finally:
+        for _, future in pending:
+            future.cancel()
+        executor.shutdown(wait=True)
+        loop.close()
+
+
+class _Inotify(object):
+    # Just enough of Linux's inotify, which the standard library has no
+    # binding for, to hear about files being saved, moved, or deleted.
+
+    IN_CLOSE_WRITE = 0x8
+    IN_MOVED_FROM = 0x40
+    IN_MOVED_TO = 0x80
+    IN_CREATE = 0x100
+    IN_DELETE = 0x200
+    IN_Q_OVERFLOW = 0x4000
+    IN_IGNORED = 0x8000
+    IN_ISDIR = 0x40000000
+
+    def __init__(self):
+        import ctypes
+        import ctypes.util
+        self.ctypes = ctypes
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = self.libc.inotify_init()
+        if self.fd < 0:
+            self._raise()
+        self.directories = {}
+
+    def _raise(self, path=None):
+        errno = self.ctypes.get_errno()
+        raise OSError(errno, os.strerror(errno), path)
+
+    def add(self, directory):
+        path = directory
+        if not isinstance(path, bytes):
+            path = path.encode(sys.getfilesystemencoding() or 'utf-8')
+        mask = self.IN_CLOSE_WRITE | self.IN_MOVED_FROM | self.IN_MOVED_TO | \
+            self.IN_CREATE | self.IN_DELETE
+        wd = self.libc.inotify_add_watch(self.fd, path, mask)
+        if wd < 0:
+            self._raise(directory)
+        self.directories[wd] = directory
+
+    def read(self):
+        data, offset, rv = os.read(self.fd, 65536), 0, []
+        while offset < len(data):
+            wd, mask, _, length = struct.unpack_from('iIII', data, offset)
+            offset += 16
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            if str is not bytes:
+                name = os.fsdecode(name)
+            if mask & self.IN_IGNORED:
+                # The directory is gone, and so is the watch.
+                self.directories.pop(wd, None)
+                continue
+            rv.append((self.directories.get(wd), mask, name))
+        return rv
+
+    def close(self):
+        os.close(self.fd)
+
+
+class HeaderIndex(object):
+    """
+    Results of checking a set of files, kept in memory.
+
+    Each result is stored along with the file's size, modification time, and
+    inode. :meth:`query` compares those with the file on disk and checks it
+    again if any of them differ, so a result is never stale, even if
+    :meth:`watch` has not caught up with a change yet.
+
+    The index is safe to use from several threads.
+
+    :param paths: Files and directories to index.
+    :type paths: :class:`list` of :class:`str`
+    :param str exclude: Comma-separated patterns of paths to leave out.
+    """
+
+    def __init__(self, paths, exclude=default_exclude):
+        """Create an empty index."""
+        #: Files and directories to index.
+        #:
+        #: :type: :class:`list` of :class:`str`
+        self.paths = list(paths)
+
+        #: Patterns of paths to leave out.
+        #:
+        #: :type: :class:`list` of :class:`str`
+        self.exclude = [p.strip() for p in exclude.split(',') if p.strip()]
+
+        #: Map of absolute path to ``(stamp, errors, values)``, where
+        #: ``errors`` and ``values`` are as returned from
+        #: :meth:`~flake8_ownership.Checker.run` and
+        #: :attr:`~flake8_ownership.Checker.values`.
+        #:
+        #: :type: :class:`dict`
+        self.entries = {}
+
+        self._lock = threading.Lock()
+
+    def _stamp(self, path):
+        stat = os.stat(path)
+        mtime = getattr(stat, 'st_mtime_ns', stat.st_mtime)
+        # A result from another year is stale if <YEAR> is configured.
+        return stat.st_size, mtime, stat.st_ino, Checker.clock().year
+
+    def build(self):
+        """Check every file under :attr:`paths`."""
+        for path in _find_files(self.paths, ','.join(self.exclude)):
+            self.update(path)
+
+    def update(self, path):
+        """
+        Check the file at ``path`` and store the result.
+
+        If the file no longer exists, its result is dropped instead.
+
+        :param str path: Path of the file.
+        :return: ``(errors, values)`` for the file, or :data:`None` if it
+                 does not exist.
+        :rtype: :class:`tuple` or :data:`None`
+        """
+        key = os.path.abspath(path)
+        try:
+            # Stamped before checking, so a change made while checking
+            # shows up as a different stamp next time.
+            stamp = self._stamp(path)
+            _, errors, values = _run_file(path)
+        except EnvironmentError:
+            with self._lock:
+                self.entries.pop(key, None)
+            return None
+        with self._lock:
+            self.entries[key] = (stamp, errors, values)
+        return errors, values
+
+    def query(self, path):
+        """
+        Return the result for the file at ``path``.
+
+        The file is only checked if it is not in the index yet or has
+        changed since it was checked.
+
+        :param str path: Path of the file.
+        :return: ``(errors, values)`` for the file, or :data:`None` if it
+                 does not exist.
+        :rtype: :class:`tuple` or :data:`None`
+        """
+        key = os.path.abspath(path)
+        with self._lock:
+            entry = self.entries.get(key)
+        try:
+            stamp = self._stamp(path)
+        except EnvironmentError:
+            stamp = None
+        if entry is not None and entry[0] == stamp:
+            return entry[1:]
+        return self.update(path)
+
+    def poll(self):
+        """
+        Bring the index up to date by looking at every file.
+
+        This is what :meth:`watch` falls back to without inotify.
+        """
+        seen = set()
+        for path in _find_files(self.paths, ','.join(self.exclude)):
+            seen.add(os.path.abspath(path))
+            self.query(path)
+        with self._lock:
+            for key in set(self.entries) - seen:
+                del self.entries[key]
+
+    def watch(self, stop, interval=1.0, started=None):
+        """
+        Keep the index up to date until ``stop`` is set.
+
+        On Linux, this updates the files that inotify reports as saved,
+        moved, or deleted. Elsewhere (or if inotify runs out of watches),
+        it calls :meth:`poll` every ``interval`` seconds.
+
+        :param stop: Event to stop watching.
+        :type stop: :class:`threading.Event`
+        :param float interval: Seconds between polls, and the longest it
+                               takes to notice ``stop``.
+        :param started: Event to set once changes are being watched for.
+        :type started: :class:`threading.Event` or :data:`None`
+        """
+        try:
+            inotify = _Inotify()
+        except (AttributeError, EnvironmentError, TypeError):
+            # Not Linux (no inotify_init), or no C library to be found.
+            inotify = None
+        if inotify is not None:
+            try:
+                for path in self.paths:
+                    self._watch_tree(inotify, path)
+            except EnvironmentError as e:
+                LOG.warning('cannot watch files, polling instead: %s', e)
+                inotify.close()
+                inotify = None
+        if inotify is None:
+            if started is not None:
+                started.set()
+            while not stop.wait(interval):
+                self.poll()
+            return
+        # Catch up with whatever changed before the watches were in place.
+        self.poll()
+        if started is not None:
+            started.set()
+        try:
+            while not stop.is_set():
+                if not select.select([inotify.fd], [], [], interval)[0]:
+                    continue
+                for directory, mask, name in inotify.read():
+                    if mask & inotify.IN_Q_OVERFLOW or directory is None:
+                        # Events were dropped, so anything may have changed.
+                        self.poll()
+                        continue
+                    path = os.path.join(directory, name)
+                    if _excluded(path, self.exclude):
+                        continue
+                    if not mask & inotify.IN_ISDIR:
+                        # A new file is checked once it has been written.
+                        if Checker.profiles.wanted(path) and \
+                                not mask & inotify.IN_CREATE:
+                            self.update(path)
+                    elif mask & (inotify.IN_CREATE | inotify.IN_MOVED_TO):
+                        self._watch_tree(inotify, path)
+                        exclude = ','.join(self.exclude)
+                        for path in _find_files([path], exclude):
+                            self.update(path)
+        finally:
+            inotify.close()
+
+    def _watch_tree(self, inotify, path):
+        if _excluded(path, self.exclude):
+            return
+        if not os.path.isdir(path):
+            # A single file: its directory is watched, and the events for
+            # the other files in it are checked against the exclusions.
+            inotify.add(os.path.dirname(path) or os.curdir)
+            return
+        for directory, dirnames, _ in os.walk(path):
+            dirnames[:] = [
+                d for d in dirnames
+                if not _excluded(os.path.join(directory, d), self.exclude)
+            ]
+            inotify.add(directory)
+
+
+class Daemon(object):
+    """
+    Long-running checker that answers queries over a Unix socket.
+
+    Editors that check a file every time it is saved pay for starting a
+    process, processing the configuration, and reading the file each time.
+    The daemon does all of that once: it keeps the configuration that
+    :meth:`~flake8_ownership.Checker.parse_options` processed and a
+    :class:`HeaderIndex` of the results for every file, which a background
+    thread keeps up to date with :meth:`HeaderIndex.watch`.
+
+    Clients send one JSON object per line, with the ``path`` of a file
+    (relative to the daemon's working directory, or absolute), and get one
+    JSON object per line back, with the ``path`` and the ``errors`` in it
+    (as :meth:`Reporter.record` dictionaries). If the request also has the
+    ``content`` of the file (e.g. an unsaved buffer), that is checked
+    instead, and the index is left alone. If something goes wrong, the
+    response has an ``error`` message instead. The socket is only
+    accessible to the user running the daemon.
+
+    :param str address: Path of the Unix socket to listen on.
+    :param index: Index of the files to serve.
+    :type index: :class:`HeaderIndex`
+    :param float interval: Seconds between polls, if the index is polled.
+    """
+
+    def __init__(self, address, index, interval=1.0):
+        """Initialize the daemon (call :meth:`serve_forever` to start)."""
+        self.address = address
+        self.index = index
+        self.interval = interval
+
+        #: Set once the daemon is accepting connections.
+        #:
+        #: :type: :class:`threading.Event`
+        self.ready = threading.Event()
+
+        self._stop = threading.Event()
+        self._server = None
+
+    def serve_forever(self):
+        """
+        Build the index, then serve queries until :meth:`shutdown`.
+
+        :raise EnvironmentError: If something is already listening on
+                                 :attr:`address`.
+        """
+        # socketserver is only needed here, so flake8 does not pay for
+        # importing it.
+        try:
+            import socketserver
+        except ImportError:  # pragma: no cover (python 2)
+            import SocketServer as socketserver  # noqa: N813
+        daemon = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                for line in self.rfile:
+                    response = daemon.answer(line)
+                    self.wfile.write(json.dumps(response).encode('utf-8'))
+                    self.wfile.write(b'\n')
+                    self.wfile.flush()
+
+        if os.path.exists(self.address):
+            client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                client.connect(self.address)
+            except EnvironmentError:
+                # Left behind by a daemon that is no longer running.
+                os.remove(self.address)
+            else:
+                raise EnvironmentError('already listening on %s' %
+                                       self.address)
+            finally:
+                client.close()
+
+        self.index.build()
+        # Only the daemon's user may connect, since the daemon reads any
+        # file it is asked about.
+        umask = os.umask(0o077)
+        try:
+            server = socketserver.ThreadingUnixStreamServer(
+                self.address,
+                Handler,
+            )
+        finally:
+            os.umask(umask)
+        server.daemon_threads = True
+        self._server = server
+        started = threading.Event()
+        watcher = threading.Thread(
+            target=self.index.watch,
+            args=(self._stop, self.interval, started),
+        )
+        watcher.daemon = True
+        watcher.start()
+        while not started.wait(self.interval) and watcher.is_alive():
+            pass
+        self.ready.set()
+        try:
+            server.serve_forever(poll_interval=self.interval)
+        finally:
+            self._stop.set()
+            server.server_close()
+            if os.path.exists(self.address):
+                os.remove(self.address)
+            watcher.join()
+
+    def shutdown(self):
+        """Stop :meth:`serve_forever`, from another thread."""
+        self._stop.set()
+        if self._server is not None:
+            self._server.shutdown()
+
+    def answer(self, line):
+        """
+        Answer a request.
+
+        :param bytes line: The request, a line of JSON.
+        :return: The response, see :class:`Daemon`.
+        :rtype: :class:`dict`
+        """
+        try:
+            request = json.loads(line.decode('utf-8'))
+        except ValueError as e:
+            return dict(error='bad request: %s' % e)
+        if not isinstance(request, dict):
+            return dict(error='bad request: expected an object')
+        path, content = request.get('path'), request.get('content')
+        text = type(u'')
+        if not isinstance(path, text):
+            return dict(error='bad request: "path" must be a string')
+        if content is not None and not isinstance(content, text):
+            return dict(error='bad request: "content" must be a string')
+        try:
+            if content is not None:
+                content = content.encode('utf-8')
+                _, errors, values = _check_content(path, content)
+            else:
+                result = self.index.query(path)
+                if result is None:
+                    return dict(error='no such file: %s' % path, path=path)
+                errors, values = result
+        except ValueError as e:
+            # E.g. a NUL in the path, or a lone surrogate in the content.
+            return dict(error='bad request: %s' % e, path=path)
+        reporter = Reporter(None)
+        errors = [reporter.record(path, error, values) for error in errors]
+        return dict(errors=errors, path=path)
+
+
+def main(argv=None):
+    """
+    Run the standalone scanner, which is the ``flake8-ownership`` command.
+
+    This applies the same checks as the flake8 extension, without the cost
+    of starting up flake8 and all of its plugins. It reads the same options
+    from the ``[flake8]`` section of the configuration, checks files across
+    a pool of processes, and prints errors in flake8's default format as
+    results come in. With ``--fix`` (or ``--diff``), it rewrites stale
+    ``:copyright:`` lines with :func:`fix` instead, with ``--report``, it
+    counts the tag values with an :class:`Inventory`, and with ``--serve``,
+    it runs a :class:`Daemon`.
+
+    :param argv: Command line arguments, defaults to :data:`sys.argv`.
+    :type argv: :class:`list` of :class:`str` or :data:`None`
+    :return: Exit status, ``1`` if any errors were found or any files could
+             not be read (or, with ``--diff``, if any changes would be
+             made), else ``0``.
+    :rtype: :class:`int`
+    """
+    parser = argparse.ArgumentParser(
+        prog='flake8-ownership',
+        description='Check author, copyright, and license tags.',
+    )
+    parser.add_argument(
+        'paths',
+        default=['.'],
+        help='files and directories to check (default: .)',
+        metavar='path',
+        nargs='*',
+    )
+    parser.add_argument(
+        '--config',
+        help='configuration file to read (default: the first of %s in the '
+             'current directory)' % ', '.join(config_files),
+    )
+    parser.add_argument(
+        '-j',
+        '--jobs',
+        default=multiprocessing.cpu_count(),
+        help='number of processes to use (default: number of CPUs)',
+        type=int,
+    )
+    parser.add_argument(
+        '--concurrency',
+        default=0,
+        help='check files in a single process, keeping this many file reads '
+             'in flight (for slow filesystems; default: use --jobs)',
+        type=int,
+    )
+    parser.add_argument(
+        '--format',
+        choices=sorted(reporters),
+        default='default',
+        help='output format: default (same as flake8), jsonl (JSON Lines), '
+             'or sarif (default: default)',
+    )
+    parser.add_argument(
+        '--fix',
+        action='store_true',
+        help='rewrite stale :copyright: lines to match --copyright-re '
+             'instead of reporting errors',
+    )
+    parser.add_argument(
+        '--diff',
+        action='store_true',
+        help='print the changes --fix would make as a diff, without '
+             'writing them (implies --fix)',
+    )
+    parser.add_argument(
+        '--report',
+        choices=('json', 'table'),
+        help='instead of reporting errors, count the files with each value '
+             'of each tag and print the counts as a table or JSON',
+    )
+    parser.add_argument(
+        '--diff-base',
+        help='only check files changed since this git ref (and, if '
+             '--ownership-max-lines is set, only if the change touches the '
+             'header)',
+        metavar='ref',
+    )
+    parser.add_argument(
+        '--serve',
+        help='instead of checking once, keep the results in memory, update '
+             'them as files change, and answer queries on this Unix socket',
+        metavar='socket',
+    )
+    parser.add_argument(
+        '--poll-interval',
+        default=1.0,
+        help='with --serve, seconds between looking for changed files if '
+             'inotify is not available (default: 1)',
+        type=float,
+    )
+    options = _OptionParser(parser)
+    options.add_option(
+        '--exclude',
+        default=default_exclude,
+        help='comma-separated patterns of paths to exclude (default: %s)' %
+             default_exclude,
+        parse_from_config=True,
+    )
+    Checker.add_options(options)
+
+    args = parser.parse_args(argv)
+    config = args.config
+    if config is None:
+        for path in config_files:
+            if os.path.isfile(path):
+                config = path
+                break
+    if config is not None:
+        options.read_config(config)
+        args = parser.parse_args(argv)
+    try:
+        Checker.parse_options(args)
+    except OptionError as e:
+        parser.error(str(e))
+    if args.diff:
+        args.fix = True
+    if args.fix and args.report:
+        parser.error('--report cannot be used with --fix')
+    if (args.fix or args.report) and args.concurrency > 0:
+        parser.error('--concurrency cannot be used with --fix or --report')
+    if args.serve is not None:
+        if args.fix or args.report or args.diff_base or args.concurrency:
+            parser.error('--serve cannot be used with --fix, --report, '
+                         '--diff-base, or --concurrency')
+        index = HeaderIndex(args.paths, args.exclude)
+        daemon = Daemon(args.serve, index, args.poll_interval)
+        # Stop as for ^C, so the socket is removed on the way out.
+        signal.signal(signal.SIGTERM, signal.default_int_handler)
+        try:
+            daemon.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        except EnvironmentError as e:
+            parser.error('cannot serve on %s: %s' % (args.serve, e))
+        return 0
+
+    if args.diff_base is None:
+        paths = _find_files(args.paths, args.exclude)
+    else:
+        header_lines = Checker.max_lines or None
+        try:
+            paths = _find_changed_files(
+                args.paths,
+                args.exclude,
+                args.diff_base,
+                header_lines,
+            )
+        except (OSError, subprocess.CalledProcessError) as e:
+            parser.error('could not get changes from git: %s' % e)
+
+    pool = None
+    worker = _check_file
+    if args.fix:
+        worker = functools.partial(_fix_file, dry_run=args.diff)
+    elif args.report:
+        worker = _inventory_file
+    if args.concurrency > 0:
+        results = scan(paths, args.concurrency)
+    elif args.jobs > 1:
+        pool = multiprocessing.Pool(
+            args.jobs,
+            initializer=Checker.configure,
+            initargs=(Checker.config,),
+        )
+        results = pool.imap(worker, paths, chunksize=16)
+    else:
+        results = (worker(path) for path in paths)
+
+    rv = 0
+    try:
+        if args.fix:
+            errors_reporter = Reporter(sys.stderr)
+            for path, change, errors in results:
+                for error in errors:
+                    rv = 1
+                    errors_reporter.report(path, error, {})
+                if change is None:
+                    continue
+                line, old, new = change
+                if args.diff:
+                    rv = 1
+                    diff = '--- %s\n+++ %s\n@@ -%i +%i @@\n-%s\n+%s\n'
+                    sys.stdout.write(diff % (path, path, line, line, old, new))
+                else:
+                    sys.stdout.write('%s:%i: fixed copyright\n' % (path, line))
+            return rv
+        if args.report:
+            # Files that could not be read are not counted, but are
+            # reported on stderr (as they are with --fix), so the report
+            # itself stays parseable.
+            inventory, errors_reporter = Inventory(), Reporter(sys.stderr)
+            for path, found, errors in results:
+                for error in errors:
+                    rv = 1
+                    errors_reporter.report(path, error, {})
+                if found is not None:
+                    inventory.add(found)
+            if args.report == 'json':
+                json.dump(inventory.summary(), sys.stdout, sort_keys=True)
+                sys.stdout.write('\n')
+            else:
+                inventory.write_table(sys.stdout)
+            return rv
+        reporter = reporters[args.format](sys.stdout)
+        reporter.start()
+        for path, errors, values in results:
+            for error in errors:
+                rv = 1
+                reporter.report(path, error, values)
+        reporter.finish()
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+    return rv
@@ -6,16 +6,41 @@ Tests for flake8-ownership.
 :copyright: Copyright (c) Joe Joyce and contributors, 2016-2019.
 :license: BSD
 """
+import ast
 import datetime
+import json
+import multiprocessing
 import os
+import pickle
 import re
+import shutil
+import signal
+import socket
+import subprocess
+import sys
 import tempfile
+import threading
+import time
 import unittest
 
+try:
+    import asyncio
+except ImportError:  # pragma: no cover (python 2)
+    asyncio = None
+
+try:
+    import tracemalloc
+except ImportError:  # pragma: no cover (python 2, pypy)
+    tracemalloc = None
+
 import flake8.plugins.manager
 import mock
+from flake8.exceptions import ExecutionError
 
-from flake8_ownership import Checker
+from flake8_ownership import Checker, compile_cache, Matcher, OptionError, \
+    PolicyIndex, print_stats
+from flake8_ownership_cli import _check_content, check_headers, Daemon, \
+    HeaderIndex, main, scan
 
 
 #: "Standard" test value for the author.
@@ -49,6 +74,13 @@ test_license = 'BSD'
 test_license_re = re.compile(r'^BSD$')
 
 
+# Whether git is available, for the tests of the --diff-base mode.
+try:
+    subprocess.check_output(['git', '--version'])
+    has_git = True
+except (OSError, subprocess.CalledProcessError):
+    has_git = False
+
 #: Entry point name under which this module should be registered.
 #:
 #: :type: :class:`str`
@@ -64,15 +96,26 @@ class RegistrationTest(unittest.TestCase):
         msg = 'Entry point %s is not registered' % test_name
         self.assertTrue(test_name in checkers, msg)
 
+    def test_lazy_imports(self):
+        """Test that slow imports are deferred until they are needed."""
+        modules = ('argparse', 'asyncio', 'hashlib', 'mmap', 'multiprocessing',
+                   'shutil', 'socket', 'subprocess', 'tempfile')
+        code = 'import sys, flake8_ownership; ' \
+            'print(" ".join(m for m in %r if m in sys.modules))' % (modules,)
+        env = dict(os.environ, PYTHONPATH=os.path.dirname(
+            os.path.abspath(Checker.run.__code__.co_filename),
+        ))
+        output = subprocess.check_output([sys.executable, '-c', code], env=env)
+        self.assertEqual(b'', output.strip())
+
 
 class OptionTest(unittest.TestCase):
     """Test the option handling for the checker."""
 
     def setUp(self):
-        """Reset checker."""
-        Checker.author_re = None
-        Checker.copyright_re = None
-        Checker.license_re = None
+        """Reset checker and the compile cache."""
+        compile_cache.clear()
+        Checker.parse_options(mock.Mock(spec=()))
 
     def test_add_options(self):
         """Test :meth:`flake8_ownership.Checker.add_options`."""
@@ -104,9 +147,30 @@ class OptionTest(unittest.TestCase):
         self.assertEqual(r2string_expected, r2string)
         self.assertTrue(type(r2regex) is type(re.compile('')))  # noqa: E721
 
+    def test_compile_cache(self):
+        """Test that option values are only compiled once."""
+        options = mock.Mock(spec=())
+        options.author_re = '^(a+)+$'
+        options.license_re = '^BSD$'
+        with mock.patch('flake8_ownership.sys.stderr') as stderr:
+            Checker.parse_options(options)
+            matcher = Checker.plan.index['license'].expected
+            Checker.parse_options(options)
+        self.assertTrue(Checker.plan.index['license'].expected is matcher)
+        self.assertEqual(1, stderr.write.call_count)
+        options.ownership_reject_nested_repeats = True
+        self.assertRaises(OptionError, Checker.parse_options, options)
+
+        options = mock.Mock(spec=())
+        with mock.patch('flake8_ownership.compile_cache_size', 2):
+            for value in ('^A$', '^B$', '^A$', '^C$'):
+                options.license_re = value
+                Checker.parse_options(options)
+        self.assertEqual(['^A$', '^C$'], list(compile_cache))
+
     def test_parse_options(self):
         """Test :meth:`flake8_ownership.Checker.parse_options`."""
-        options = mock.Mock()
+        options = mock.Mock(spec=())
         options.author_re = ''
         options.copyright_re = 'item 1'
         options.license_re = 'item 2, item 3'
@@ -114,6 +178,21 @@ class OptionTest(unittest.TestCase):
         self.assertEqual(0, len(Checker.author_re))
         self.assertEqual(1, len(Checker.copyright_re))
         self.assertEqual(2, len(Checker.license_re))
+        self.assertEqual(
+            [('copyright', 'O101'), ('license', 'O102')],
+            [(tag.name, tag.code) for tag in Checker.plan.tags],
+        )
+
+    def test_parse_options_header(self):
+        """Test parsing of the header window options."""
+        options = mock.Mock(spec=())
+        options.ownership_max_lines = 10
+        options.ownership_stop_at_docstring = True
+        options.ownership_docstring_only = True
+        Checker.parse_options(options)
+        self.assertEqual(10, Checker.max_lines)
+        self.assertTrue(Checker.stop_at_docstring)
+        self.assertTrue(Checker.docstring_only)
 
     def test_parse_options_none(self):
         """Test when option is not defined or has a default value of None."""
@@ -123,6 +202,135 @@ class OptionTest(unittest.TestCase):
         self.assertEqual(0, len(Checker.author_re))
         self.assertEqual(0, len(Checker.copyright_re))
         self.assertEqual(0, len(Checker.license_re))
+        self.assertEqual(0, Checker.max_lines)
+        self.assertFalse(Checker.stop_at_docstring)
+
+    def test_nested_repeats(self):
+        """Test that regexes with nested repeats are warned about."""
+        options = mock.Mock(spec=())
+        options.author_re = '^(Joe|Bob)+ [a-z]+$, ^(a+)+$'
+        options.license_re = r'^(\w+\s?)*$'
+        with mock.patch('flake8_ownership.sys.stderr') as stderr:
+            Checker.parse_options(options)
+        self.assertEqual(2, stderr.write.call_count)
+        self.assertIn('^(a+)+$', stderr.write.call_args_list[0][0][0])
+
+        options.ownership_reject_nested_repeats = True
+        try:
+            Checker.parse_options(options)
+        except ExecutionError as e:
+            self.assertTrue(isinstance(e, OptionError))
+            self.assertIn('author-re', str(e))
+        else:
+            self.fail('expected an error')
+
+    def test_invalid_regex(self):
+        """Test that an invalid regex is an option error."""
+        options = mock.Mock(spec=())
+        options.license_re = '^(BSD$'
+        self.assertRaises(OptionError, Checker.parse_options, options)
+
+    def test_comment_prefixes(self):
+        """Test parsing of the comment-prefix profiles."""
+        options = mock.Mock(spec=())
+        options.ownership_comment_prefixes = '.sh yml=#, .js = //, .pyi='
+        Checker.parse_options(options)
+        profiles = Checker.profiles
+        self.assertEqual(
+            frozenset(['.py', '.sh', '.yml', '.js', '.pyi']),
+            profiles.extensions,
+        )
+        self.assertEqual('#', profiles.lookup('a/b.yml').prefix)
+        self.assertEqual('//', profiles.lookup('b.js').prefix)
+        self.assertEqual('', profiles.lookup('b.pyi').prefix)
+        self.assertTrue(profiles.lookup('b.txt') is profiles.default)
+        self.assertTrue(profiles.lookup('b.sh') is profiles.lookup('b.yml'))
+
+        options.ownership_comment_prefixes = '#'
+        self.assertRaises(OptionError, Checker.parse_options, options)
+
+
+class MatcherTest(unittest.TestCase):
+    """Test the combined matching of expected values."""
+
+    def matcher(self, *patterns):
+        """
+        Return a :class:`flake8_ownership.Matcher` for ``patterns``.
+
+        :param patterns: Regex strings to match against.
+        :return: Matcher for the patterns.
+        :rtype: :class:`flake8_ownership.Matcher`
+        """
+        return Matcher([(p, re.compile(p)) for p in patterns])
+
+    def test_combined(self):
+        """Test that the matching alternative is reported."""
+        matcher = self.matcher('^Jo+e$', '^Bo[b]$', 'Sam')
+        self.assertTrue(matcher._combined is not None)
+        self.assertEqual(0, matcher.search('Joe'))
+        self.assertEqual(1, matcher.search('Bob'))
+        self.assertEqual(2, matcher.search('Uncle Sam'))
+        self.assertEqual(None, matcher.search('Joe Bob'))
+
+    def test_literals(self):
+        """Test that anchored literals are looked up, not searched."""
+        matcher = self.matcher(
+            '^BSD$',
+            r'^Copyright \(c\) Joe, 2016\.$',
+            '^MIT.*$',
+            r'^GPL\$',
+            r'^\w+ Public$',
+            '^Apache$',
+        )
+        self.assertEqual(
+            {'BSD': 0, 'Copyright (c) Joe, 2016.': 1, 'Apache': 5},
+            matcher._literals,
+        )
+        self.assertEqual(0, matcher.search('BSD'))
+        self.assertEqual(1, matcher.search('Copyright (c) Joe, 2016.'))
+        self.assertEqual(2, matcher.search('MIT License'))
+        self.assertEqual(None, matcher.search('GPL'))
+        self.assertEqual(4, matcher.search('Mozilla Public'))
+        self.assertEqual(5, matcher.search('Apache'))
+        self.assertEqual(None, matcher.search('BSD '))
+
+    def test_groups(self):
+        """Test that regexes with groups are searched separately."""
+        matcher = self.matcher('^Joe$', '^(Bob|Sam) Smith$', '^Pat$')
+        self.assertEqual(1, matcher.search('Sam Smith'))
+        self.assertEqual(2, matcher.search('Pat'))
+        self.assertEqual(None, matcher.search('Joe Smith'))
+
+    def test_uncombinable(self):
+        """Test fallback when the regexes cannot be combined."""
+        matcher = self.matcher('^Joe$', '(?i)^bob$', '^Sam$')
+        self.assertEqual(1, matcher.search('BOB'))
+        self.assertEqual(2, matcher.search('Sam'))
+        self.assertEqual(None, matcher.search('JOE'))
+
+    def test_year(self):
+        """Test that ``<YEAR>`` is checked against the year when matching."""
+        options = mock.Mock(spec=())
+        options.test = r'^Joe<COMMA> 2016-<YEAR>$, Bob <YEAR>, Bob Jr\.,' \
+            '^(Sam|Pat) <YEAR>$'
+        matcher = Matcher(Checker._compile_option(options, 'test')[0])
+        self.assertTrue(matcher.dated)
+        self.assertEqual(0, matcher.search('Joe, 2016-2020', 2020))
+        self.assertEqual(None, matcher.search('Joe, 2016-2020', 2021))
+        self.assertEqual(0, matcher.search('Joe, 2016-2021', 2021))
+        self.assertEqual(1, matcher.search('Bob 2021', 2021))
+        self.assertEqual(None, matcher.search('Bob 2020', 2021))
+        self.assertEqual(3, matcher.search('Pat 2021', 2021))
+        self.assertEqual(None, matcher.search('Pat 2020', 2021))
+
+        # The first match has the wrong year, but a later one does not.
+        self.assertEqual(1, matcher.search('Bob 2020, Bob 2021', 2021))
+        self.assertEqual(2, matcher.search('Bob 2020, Bob Jr.', 2021))
+
+        clock = staticmethod(lambda: datetime.date(2020, 12, 31))
+        with mock.patch.object(Checker, 'clock', clock):
+            self.assertEqual(1, matcher.search('Bob 2020'))
+            self.assertEqual(None, matcher.search('Bob 2021'))
 
 
 class CheckerTest(unittest.TestCase):
@@ -130,9 +338,7 @@ class CheckerTest(unittest.TestCase):
 
     def setUp(self):
         """Reset checker, create temporary file for checker tests."""
-        Checker.author_re = None
-        Checker.copyright_re = None
-        Checker.license_re = None
+        Checker.parse_options(mock.Mock(spec=()))
         self._tmp_fd, self._tmp_path = tempfile.mkstemp()
         self._tmp = os.fdopen(self._tmp_fd, 'w')
 
@@ -166,34 +372,47 @@ class CheckerTest(unittest.TestCase):
         if extra is not None:
             self._tmp.write('%s\n' % extra)
 
-    def check(self):
+    def check(self, tree=False):
         """
         Run checker on the temporary file (call after :meth:`write`).
 
+        :param bool tree: Whether to parse the file and pass the AST to the
+                          checker.
         :return: List of errors from the checker. Each error is of the format
                  ``(line<int>, column<int>, message<str>, klass<type>)``.
         :rtype: :class:`list`
         """
-        self._tmp.flush()
         self._tmp.close()
-        return list(Checker(None, self._tmp_path).run())
+        if tree:
+            with open(self._tmp_path) as f:
+                tree = ast.parse(f.read())
+        else:
+            tree = None
+        return list(Checker(tree, self._tmp_path).run())
 
-    def configure(self, author=False, copyright=False, license=False):
+    def configure(self, author=False, copyright=False, license=False,
+                  **kwargs):
         """
         Configure the checker.
 
         :param bool author: Whether to enable author checking.
         :param bool copyright: Whether to enable copyright checking.
         :param bool license: Whether to enable license checking.
+        :param kwargs: Other options to set.
         """
+        options = mock.Mock(spec=(), **kwargs)
         if author:
-            Checker.author_re = [test_author_re]
+            options.author_re = test_author_re.pattern
         if copyright:
-            Checker.copyright_re = [test_copyright_re]
+            options.copyright_re = test_copyright_re.pattern.replace(
+                ',',
+                '<COMMA>',
+            )
         if license:
-            Checker.license_re = [test_license_re]
+            options.license_re = test_license_re.pattern
+        Checker.parse_options(options)
 
-    def assert_error(self, line, column, message):
+    def assert_error(self, line, column, message, tree=False):
         """
         Assert that that the file has a single error.
 
@@ -203,8 +422,9 @@ class CheckerTest(unittest.TestCase):
         :type column: int
         :param message: Error message.
         :type message: str
+        :param bool tree: Whether to pass the AST to the checker.
         """
-        errors = self.check()
+        errors = self.check(tree)
 
         fmt = 'expected exactly one error, got %i'
         self.assertEqual(1, len(errors), fmt % len(errors))
@@ -228,6 +448,12 @@ class CheckerTest(unittest.TestCase):
         fmt = 'expected no errors, got %i'
         self.assertEqual(0, len(errors), fmt % len(errors))
 
+    def test_unconfigured(self):
+        """Check that the file is not touched if nothing is configured."""
+        path = self._tmp_path + '.missing'
+        self.assertEqual([], list(Checker(None, path).run()))
+        self.assertEqual([], Checker(None, path).check_content(b''))
+
     def test_valid(self):
         """Full author/copyright/license with a file that should be valid."""
         self.configure(author=True, copyright=True, license=True)
@@ -277,6 +503,21 @@ class CheckerTest(unittest.TestCase):
         self.write(license=':license: NotARealLicense')
         self.assert_error(2, 0, 'O102 unrecognized license')
 
+    @unittest.skipUnless(hasattr(signal, 'setitimer'), 'needs setitimer')
+    def test_match_timeout(self):
+        """Check that a match that takes too long fails the file."""
+        with mock.patch('flake8_ownership.sys.stderr'):
+            self.configure(
+                license_re='^(a+)+$',
+                ownership_match_timeout=0.1,
+            )
+        self.write(license='a' * 64 + 'b')
+        start = time.time()
+        self.assert_error(2, 0, 'O103 timed out checking license')
+        self.assertLess(time.time() - start, 5)
+        # The handler is only installed while matching.
+        self.assertEqual(signal.SIG_DFL, signal.getsignal(signal.SIGALRM))
+
     def test_stops_checking_when_satisfied(self):
         """Check that the checker returns immediately once it is satisfied."""
         self.configure(author=True)
@@ -284,3 +525,1331 @@ class CheckerTest(unittest.TestCase):
         errors = self.check()
         fmt = 'expected no errors, got %i'
         self.assertEqual(0, len(errors), fmt % len(errors))
+
+    def test_lines(self):
+        """Check that lines supplied by flake8 are used instead of the file."""
+        self.configure(author=True, license=True)
+        lines = [
+            '\n',
+            ':author: %s\n' % test_author,
+            ':license: NotARealLicense',
+        ]
+        with mock.patch('flake8_ownership.open', create=True) as open_:
+            errors = list(Checker(None, 'stdin', lines).run())
+        self.assertFalse(open_.called, 'expected file not to be opened')
+        self.assertEqual([(3, 0, 'O102 unrecognized license')],
+                         [error[:3] for error in errors])
+
+    def test_no_trailing_newline(self):
+        """Check that the last line is not truncated without a newline."""
+        self.configure(license=True)
+        self._tmp.write(':license: %s' % test_license)
+        errors = self.check()
+        fmt = 'expected no errors, got %i'
+        self.assertEqual(0, len(errors), fmt % len(errors))
+
+    def test_max_lines(self):
+        """Check that tags past the maximum number of lines are not found."""
+        self.configure(author=True, license=True)
+        Checker.max_lines = 2
+        self.write(author=test_author, license=test_license)
+        self.assert_error(0, 0, 'O102 missing license')
+
+    def test_stop_at_docstring(self):
+        """Check that tags after the module docstring are not found."""
+        self.configure(author=True, license=True)
+        Checker.stop_at_docstring = True
+        self._tmp.write('"""\n:author: %s\n"""\n' % test_author)
+        self._tmp.write('x = """\n:license: %s\n"""\n' % test_license)
+        errors = self.check(tree=True)
+        self.assertEqual(['O102 missing license'], [e[2] for e in errors])
+
+    def test_stop_at_docstring_no_docstring(self):
+        """Check that nothing past the first statement is scanned."""
+        self.configure(license=True)
+        Checker.stop_at_docstring = True
+        self._tmp.write('# Comment.\nx = """\n:license: %s\n"""\n' % (
+            test_license,
+        ))
+        self.assert_error(0, 0, 'O102 missing license', tree=True)
+
+    def test_docstring_only(self):
+        """Check that only the docstring is searched, without a file read."""
+        self.configure(author=True, license=True)
+        Checker.docstring_only = True
+        self._tmp.write('# Comment.\n"""\nModule.\n\n:author: %s\n"""\n' % (
+            test_author,
+        ))
+        self._tmp.write('# :license: %s\n' % test_license)
+        self._tmp.write('x = """\n:license: %s\n"""\n' % test_license)
+        self._tmp.close()
+        with open(self._tmp_path) as f:
+            tree = ast.parse(f.read())
+        with mock.patch('flake8_ownership.open', create=True) as open_:
+            errors = list(Checker(tree, self._tmp_path).run())
+        self.assertFalse(open_.called, 'expected the file not to be read')
+        self.assertEqual(['O102 missing license'], [e[2] for e in errors])
+
+    def test_docstring_only_line(self):
+        """Check that line numbers in docstring-only mode are the file's."""
+        self.configure(license=True)
+        Checker.docstring_only = True
+        self._tmp.write('# Comment.\n\n"""\nModule.\n\n:license: Nope\n"""\n')
+        self.assert_error(6, 0, 'O102 unrecognized license', tree=True)
+
+    def test_docstring_only_no_docstring(self):
+        """Check that all tags are missing if there is no docstring."""
+        self.configure(license=True)
+        Checker.docstring_only = True
+        self._tmp.write('x = """\n:license: %s\n"""\n' % test_license)
+        self.assert_error(0, 0, 'O102 missing license', tree=True)
+
+    def test_find_tags(self):
+        """Check that the tags are found without being checked."""
+        self.configure(author=True, license=True)
+        self.write(author='Bob Wrongman', copyright=test_copyright)
+        self._tmp.close()
+        self.assertEqual(
+            {'author': (2, 'Bob Wrongman')},
+            Checker(None, self._tmp_path).find_tags(),
+        )
+
+    def test_unconfigured_tag_ignored(self):
+        """Check that tags which are not configured are not validated."""
+        self.configure(license=True)
+        self.write(author='Bob Wrongman <bob@example.com>', license='BSD')
+        errors = self.check()
+        fmt = 'expected no errors, got %i'
+        self.assertEqual(0, len(errors), fmt % len(errors))
+
+    def write_bytes(self, content):
+        """
+        Replace the contents of the temporary file with ``content``.
+
+        :param bytes content: Raw content for the file.
+        """
+        self._tmp.close()
+        with open(self._tmp_path, 'wb') as f:
+            f.write(content)
+
+    def test_encoding(self):
+        """Check that values are decoded using the declared encoding."""
+        self.configure(author_re=u'^Jos\xe9$')
+        self.write_bytes(b'# -*- coding: latin-1 -*-\n:author: Jos\xe9\n')
+        errors = self.check()
+        fmt = 'expected no errors, got %i'
+        self.assertEqual(0, len(errors), fmt % len(errors))
+
+    def test_crlf(self):
+        """Check that CRLF line endings are not part of the value."""
+        self.configure(license=True)
+        self.write_bytes(b'\r\n:license: BSD\r\n')
+        errors = self.check()
+        fmt = 'expected no errors, got %i'
+        self.assertEqual(0, len(errors), fmt % len(errors))
+
+    def test_comment_prefix(self):
+        """Check a file whose tags follow a comment prefix."""
+        self.configure(license=True, ownership_comment_prefixes='.sh=#')
+        path = self._tmp_path + '.sh'
+        self.addCleanup(os.remove, path)
+        content = '#!/bin/sh\n:license: %s\n#  :license: %s\n' % (
+            test_license,
+            test_license,
+        )
+        with open(path, 'w') as f:
+            f.write(content)
+        self.assertEqual([], list(Checker(None, path).run()))
+        lines = content.splitlines(True)
+        self.assertEqual([], list(Checker(None, path, lines).run()))
+        self.assertEqual(
+            {'license': (3, test_license)},
+            Checker(None, path).find_tags(),
+        )
+        # A bare tag line is not a tag in a shell script...
+        with open(path, 'w') as f:
+            f.write(':license: %s\n' % test_license)
+        errors = list(Checker(None, path).run())
+        self.assertEqual(['O102 missing license'], [e[2] for e in errors])
+        # ...and Python files are unaffected.
+        self.write(license=test_license)
+        self.assertEqual([], self.check())
+
+    def test_empty_file(self):
+        """Check that an empty file (which cannot be mapped) is handled."""
+        self.configure(license=True)
+        self.write_bytes(b'')
+        self.assert_error(0, 0, 'O102 missing license')
+
+    def test_preformatted_messages(self):
+        """Check that messages come from the plan, not formatted per file."""
+        self.configure(author=True, license=True)
+        lines = [':author: Bob Wrongman <bob@example.com>\n']
+        errors = list(Checker(None, 'stdin', lines).run())
+        author, license = Checker.plan.tags
+        self.assertTrue(errors[0][2] is author.unrecognized)
+        self.assertTrue(errors[1][2] is license.missing)
+
+    @unittest.skipIf(tracemalloc is None, 'tracemalloc is not available')
+    def test_allocations(self):
+        """Check that scanning a file allocates little beyond generators."""
+        self.configure(author=True, copyright=True, license=True)
+        lines = [
+            '"""\n',
+            ':author: Bob Wrongman <bob@example.com>\n',
+            ':copyright: %s\n' % test_copyright,
+            ':license: %s\n' % test_license,
+            '"""\n',
+        ]
+        list(Checker(None, 'stdin', lines).run())
+
+        # Pause the check at the first error, while the scan is in progress,
+        # and look at what the extension has allocated at that point.
+        tracemalloc.start()
+        try:
+            errors = Checker(None, 'stdin', lines).run()
+            next(errors)
+            snapshot = tracemalloc.take_snapshot()
+        finally:
+            tracemalloc.stop()
+        list(errors)
+
+        filename = Checker.run.__code__.co_filename
+        snapshot = snapshot.filter_traces([tracemalloc.Filter(True, filename)])
+        size = sum(stat.size for stat in snapshot.statistics('filename'))
+        msg = 'expected less than 1200 bytes allocated, got %i' % size
+        self.assertTrue(size < 1200, msg)
+
+    def test_stats(self):
+        """Check that statistics are recorded and summarized."""
+        fd, stats_file = tempfile.mkstemp()
+        os.close(fd)
+        self.addCleanup(os.unlink, stats_file)
+        with mock.patch('flake8_ownership.atexit.register') as register:
+            self.configure(author=True, license=True,
+                           ownership_stats=stats_file)
+        register.assert_called_once_with(
+            print_stats,
+            stats_file,
+            mock.ANY,
+            mock.ANY,
+        )
+
+        self.write(author=test_author, extra='x = 1\ny = 2')
+        self.assert_error(0, 0, 'O102 missing license')
+        with open(stats_file) as f:
+            records = [json.loads(line) for line in f]
+        self.assertEqual(1, len(records))
+        filename, seconds, scanned, regex_calls, cache_hit = records[0]
+        self.assertEqual(self._tmp_path, filename)
+        self.assertEqual((4, 2, None), (scanned, regex_calls, cache_hit))
+
+        stream = mock.Mock()
+        print_stats(stats_file, 0, stream)
+        output = ''.join(call[0][0] for call in stream.write.call_args_list)
+        self.assertTrue('files checked: 1\n' in output, output)
+        self.assertTrue('lines scanned: 4\n' in output, output)
+        self.assertTrue(self._tmp_path in output, output)
+
+    def cache_entries(self, cache_dir):
+        """
+        Return the paths of the entries in the cache.
+
+        :param str cache_dir: Cache directory.
+        :return: Sorted list of paths to cache entries.
+        :rtype: :class:`list`
+        """
+        rv = []
+        for directory, _, filenames in os.walk(cache_dir):
+            rv.extend(os.path.join(directory, f) for f in filenames)
+        stamp = os.path.join(cache_dir, 'pruned')
+        return sorted(path for path in rv if path != stamp)
+
+    def test_cache(self):
+        """Check that results are cached and reused."""
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        self.configure(license=True, ownership_cache_dir=cache_dir)
+        self.write(license='NotARealLicense')
+        self.assert_error(2, 0, 'O102 unrecognized license')
+        self.assertEqual(1, len(self.cache_entries(cache_dir)))
+
+        with mock.patch.object(Checker, '_check') as check:
+            checker = Checker(None, self._tmp_path)
+            errors = list(checker.run())
+        self.assertFalse(check.called, 'expected results from the cache')
+        self.assertEqual(
+            [(2, 0, 'O102 unrecognized license', Checker)],
+            errors,
+        )
+        self.assertEqual({'license': 'NotARealLicense'}, checker.values)
+
+    def test_cache_head(self):
+        """Check that only the lines that are scanned are read for the key."""
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        self.configure(
+            license=True,
+            ownership_cache_dir=cache_dir,
+            ownership_max_lines=3,
+        )
+        self.write(license='NotARealLicense', extra='x = 1')
+        self.assert_error(2, 0, 'O102 unrecognized license')
+        with open(self._tmp_path, 'a') as f:
+            f.write('y = 2\n')
+        checker = Checker(None, self._tmp_path)
+        self.assertEqual(1, len(list(checker.run())))
+        self.assertTrue(checker.cache_hit)
+
+        # Without a limit, the whole file would have to be read, so the
+        # key is the file's size and mtime instead.
+        self.configure(license=True, ownership_cache_dir=cache_dir)
+        with mock.patch('flake8_ownership.open', create=True) as open_:
+            open_.side_effect = open
+            self.assertEqual(1, len(list(Checker(None, self._tmp_path).run())))
+            with mock.patch.object(Checker, '_check') as check:
+                checker = Checker(None, self._tmp_path)
+                list(checker.run())
+        self.assertFalse(check.called, 'expected results from the cache')
+        self.assertTrue(checker.cache_hit)
+        opened = [call[0][0] for call in open_.call_args_list]
+        self.assertEqual(1, opened.count(self._tmp_path))
+        with open(self._tmp_path, 'w') as f:
+            f.write(':license: %s\n' % test_license)
+        os.utime(self._tmp_path, (0, 0))
+        self.assertEqual([], list(Checker(None, self._tmp_path).run()))
+
+    def test_cache_profile(self):
+        """Check that files with other comment prefixes have other entries."""
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        self.configure(
+            license=True,
+            ownership_cache_dir=cache_dir,
+            ownership_comment_prefixes='.sh=#',
+        )
+        self._tmp.close()
+        content = '# :license: %s\n' % test_license
+        lines = [content]
+        self.assertEqual([], list(Checker(None, 'a.sh', lines).run()))
+        errors = list(Checker(None, 'b.py', lines).run())
+        self.assertEqual(['O102 missing license'], [e[2] for e in errors])
+        self.assertEqual([], list(Checker(None, 'a.sh', lines).run()))
+        self.assertEqual(2, len(self.cache_entries(cache_dir)))
+
+    def test_cache_fingerprint(self):
+        """Check that a configuration change does not reuse results."""
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        self.configure(license=True, ownership_cache_dir=cache_dir)
+        fingerprint = Checker.fingerprint
+        self.write(license=test_license)
+        self.check()
+
+        self.configure(author=True, ownership_cache_dir=cache_dir)
+        self.assertNotEqual(fingerprint, Checker.fingerprint)
+        errors = list(Checker(None, self._tmp_path).run())
+        self.assertEqual(['O100 missing author'], [e[2] for e in errors])
+        self.assertEqual(2, len(self.cache_entries(cache_dir)))
+
+    def test_cache_year(self):
+        """Check that cached results for ``<YEAR>`` expire with the year."""
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        options = mock.Mock(
+            spec=(),
+            ownership_cache_dir=cache_dir,
+            ownership_cache_size=1024,
+        )
+        options.copyright_re = '^Joe<COMMA> 2016-<YEAR>$'
+        Checker.parse_options(options)
+        fingerprint = Checker.fingerprint
+        self.write(copyright='Joe, 2016-2020')
+        self._tmp.close()
+
+        def check(year):
+            clock = staticmethod(lambda: datetime.date(year, 1, 1))
+            with mock.patch.object(Checker, 'clock', clock):
+                Checker.parse_options(options)
+                return [e[2] for e in Checker(None, self._tmp_path).run()]
+
+        self.assertEqual([], check(2020))
+        self.assertEqual(['O101 unrecognized copyright'], check(2021))
+        self.assertEqual(fingerprint, Checker.fingerprint)
+        self.assertEqual(2, len(self.cache_entries(cache_dir)))
+
+    def test_cache_prune(self):
+        """Check that the oldest entries are evicted from the cache."""
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        for i in range(4):
+            path = os.path.join(cache_dir, str(i))
+            with open(path, 'w') as f:
+                f.write('x' * 10)
+            os.utime(path, (i, i))
+        self.configure(
+            license=True,
+            ownership_cache_dir=cache_dir,
+            ownership_cache_size=25,
+        )
+        expected = [os.path.join(cache_dir, name) for name in ('2', '3')]
+        self.assertEqual(expected, self.cache_entries(cache_dir))
+        self._tmp.close()
+
+    def test_cache_prune_entries(self):
+        """Check that the cache is capped by number of entries too."""
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        for i in range(4):
+            path = os.path.join(cache_dir, str(i))
+            with open(path, 'w') as f:
+                f.write('x')
+            os.utime(path, (i, i))
+        self.configure(
+            license=True,
+            ownership_cache_dir=cache_dir,
+            ownership_cache_entries=3,
+        )
+        expected = [os.path.join(cache_dir, name) for name in ('1', '2', '3')]
+        self.assertEqual(expected, self.cache_entries(cache_dir))
+        self._tmp.close()
+
+    def test_cache_prune_interval(self):
+        """Check that the cache is not walked again right after pruning."""
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        self.configure(license=True, ownership_cache_dir=cache_dir)
+        with mock.patch('flake8_ownership.os.walk') as walk:
+            self.configure(license=True, ownership_cache_dir=cache_dir)
+        self.assertFalse(walk.called)
+
+        stamp = os.path.join(cache_dir, 'pruned')
+        os.utime(stamp, (0, 0))
+        with mock.patch('flake8_ownership.os.walk') as walk:
+            self.configure(license=True, ownership_cache_dir=cache_dir)
+        self.assertTrue(walk.called)
+        self._tmp.close()
+
+
+class PolicyTest(unittest.TestCase):
+    """Test per-directory policies."""
+
+    def setUp(self):
+        """Create a temporary directory with a policy file."""
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.addCleanup(Checker.parse_options, mock.Mock(spec=()))
+        self.policies = os.path.join(self.dir, 'policies.ini')
+        with open(self.policies, 'w') as f:
+            f.write('[teams/a]\nlicense-re = ^MIT$\n')
+            f.write('[teams/a/legacy]\nlicense-re = ^GPL$\n')
+            f.write('[teams/b]\nlicense-re =\nauthor-re = ^Bob$\n')
+
+    def configure(self):
+        """Configure the checker with global options and the policy file."""
+        options = mock.Mock(spec=())
+        options.author_re = '^Joe$'
+        options.license_re = '^BSD$'
+        options.ownership_policies = self.policies
+        Checker.parse_options(options)
+
+    def check(self, name, content):
+        """
+        Write ``content`` to ``name`` and return the error messages.
+
+        :param str name: Slash-separated path relative to the directory.
+        :param str content: Content of the file.
+        :rtype: :class:`list` of :class:`str`
+        """
+        path = os.path.join(self.dir, *name.split('/'))
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as f:
+            f.write(content)
+        return [error[2] for error in Checker(None, path).run()]
+
+    def test_lookup(self):
+        """Test that the innermost directory's policy is found."""
+        root = os.path.abspath(self.dir)
+        index = PolicyIndex([
+            (os.path.join(root, 'a'), 'a', '1'),
+            (os.path.join(root, 'a', 'b'), 'b', '2'),
+        ])
+        self.assertEqual(('a', '1'), index.lookup(os.path.join(root, 'a')))
+        self.assertEqual(
+            ('a', '1'),
+            index.lookup(os.path.join(root, 'a', 'c', 'x.py')),
+        )
+        self.assertEqual(
+            ('b', '2'),
+            index.lookup(os.path.join(root, 'a', 'b', 'x.py')),
+        )
+        self.assertEqual(None, index.lookup(os.path.join(root, 'ab', 'x.py')))
+        self.assertEqual(None, index.lookup(os.path.join(root, 'x.py')))
+
+    def test_nested_repeats(self):
+        """Test that the policy file's regexes are checked for nesting too."""
+        with open(self.policies, 'a') as f:
+            f.write('[teams/c]\nlicense-re = ^(a+)+$\n')
+        compile_cache.clear()
+        with mock.patch('flake8_ownership.sys.stderr') as stderr:
+            self.configure()
+        self.assertEqual(1, stderr.write.call_count)
+        self.assertIn('[teams/c] license-re', stderr.write.call_args[0][0])
+
+        options = mock.Mock(spec=())
+        options.ownership_policies = self.policies
+        options.ownership_reject_nested_repeats = True
+        self.assertRaises(OptionError, Checker.parse_options, options)
+
+    def test_policies(self):
+        """Test that policies override the global options per directory."""
+        self.configure()
+        joe = ':author: Joe\n'
+        self.assertEqual([], self.check('x.py', joe + ':license: BSD\n'))
+        self.assertEqual(
+            [],
+            self.check('teams/a/x.py', joe + ':license: MIT\n'),
+        )
+        self.assertEqual(
+            ['O102 unrecognized license'],
+            self.check('teams/a/y.py', joe + ':license: BSD\n'),
+        )
+        self.assertEqual(
+            [],
+            self.check('teams/a/legacy/x.py', joe + ':license: GPL\n'),
+        )
+        self.assertEqual(
+            ['O100 unrecognized author'],
+            self.check('teams/b/x.py', joe),
+        )
+        self.assertEqual([], self.check('teams/b/y.py', ':author: Bob\n'))
+
+    def test_fingerprint(self):
+        """Test that each policy has its own cache fingerprint."""
+        self.configure()
+        fingerprints = set([Checker.fingerprint])
+        for name in ('a', 'a/legacy', 'b'):
+            path = os.path.join(self.dir, 'teams', *name.split('/'))
+            checker = Checker(None, os.path.join(path, 'x.py'))
+            fingerprints.add(checker.fingerprint)
+        self.assertEqual(4, len(fingerprints))
+
+    def test_cached(self):
+        """Test that the compiled policies are reused."""
+        self.configure()
+        policies = Checker.policies
+        self.configure()
+        self.assertTrue(policies is Checker.policies)
+
+
+class ConfigTest(unittest.TestCase):
+    """Test shipping the configuration to other processes."""
+
+    def setUp(self):
+        """Configure 300 authors, with the valid one last."""
+        self.addCleanup(Checker.parse_options, mock.Mock(spec=()))
+        options = mock.Mock(spec=())
+        authors = [r'^Author %i <a%i@example\.com>$' % (i, i)
+                   for i in range(150)]
+        authors.extend(r'^Author %i <a%i@.*>$' % (i, i)
+                       for i in range(150, 299))
+        authors.append(test_author_re.pattern)
+        options.author_re = ','.join(authors)
+        options.license_re = test_license_re.pattern
+        Checker.parse_options(options)
+        self.contents = [
+            ('good.py', (':author: %s\n:license: %s\n' % (
+                test_author,
+                test_license,
+            )).encode('utf-8')),
+            ('bad.py', b':author: Author 200 <a200@example.com>\n'),
+        ]
+        self.expected = [
+            ('good.py', [], {}),
+            ('bad.py', [(0, 0, 'O102 missing license')], {}),
+        ]
+
+    def test_pickle(self):
+        """Test that the configuration survives pickling."""
+        config = pickle.loads(pickle.dumps(Checker.config, 2))
+        Checker.parse_options(mock.Mock(spec=()))
+        Checker.configure(config)
+        self.assertEqual(
+            self.expected,
+            [_check_content(path, content) for path, content in self.contents],
+        )
+        matcher = config.plan.index['author'].expected
+        self.assertEqual(300, len(matcher.patterns))
+        self.assertEqual(150, len(matcher._literals))
+        self.assertEqual([], matcher._others)
+
+    @unittest.skipIf(not hasattr(multiprocessing, 'get_context'),
+                     'no spawn start method')
+    def test_spawn(self):
+        """Test that spawned workers get the configuration from the parent."""
+        context = multiprocessing.get_context('spawn')
+        pool = context.Pool(
+            2,
+            initializer=Checker.configure,
+            initargs=(Checker.config,),
+        )
+        try:
+            results = pool.starmap(_check_content, self.contents)
+            config = pool.apply(getattr, (Checker, 'config'))
+        finally:
+            pool.terminate()
+            pool.join()
+        self.assertEqual(self.expected, results)
+        self.assertEqual(Checker.fingerprint, config.fingerprint)
+        self.assertEqual(
+            Checker.plan.index['author'].expected.patterns,
+            config.plan.index['author'].expected.patterns,
+        )
+
+
+class BatchTest(unittest.TestCase):
+    """Test checking many headers at once."""
+
+    def setUp(self):
+        """Configure the author and license checks."""
+        self.addCleanup(Checker.parse_options, mock.Mock(spec=()))
+        options = mock.Mock(spec=())
+        options.author_re = '^Joe$, ^Bo+b$'
+        options.license_re = '^BSD$'
+        Checker.parse_options(options)
+        self.headers = [
+            b':author: Joe\n:license: BSD\n',
+            b'"""\n:license: GPL\n:license: BSD\n:author: Sam\n"""\n',
+            b'',
+            b'x = 1\n',
+            b':author: Bob\r\n:license: BSD',
+            b'# -*- coding: latin-1 -*-\n:author: Jos\xe9\n',
+            b':author: Joe\n:license: GPL\n',
+            b':copyright: None\n:author: Booob\n',
+        ]
+
+    def assert_same(self, headers, paths=None):
+        """Assert that the batch has the errors from the per-file checks."""
+        batch = check_headers(headers, paths)
+        self.assertEqual(len(batch.files), len(batch.messages))
+        actual = list(zip(batch.files, batch.lines, batch.codes,
+                          batch.messages, batch.values))
+        expected = []
+        for i, header in enumerate(headers):
+            path = 'file.py' if paths is None else paths[i]
+            _, errors, values = _check_content(path, header)
+            for line, _, message in errors:
+                code = int(message[1:4])
+                name = message.rsplit(' ', 1)[-1]
+                expected.append((i, line, code, message, values.get(name)))
+        self.assertEqual(expected, actual)
+        return batch
+
+    def test_check_headers(self):
+        """Test that the batch agrees with checking each header."""
+        batch = self.assert_same(self.headers)
+        self.assertEqual([1, 1, 2, 2, 3, 3, 5, 5, 6, 7], list(batch.files))
+        self.assertEqual('Jos\xe9', batch.values[6])
+        self.assertEqual('l', batch.lines.typecode)
+
+    def test_empty(self):
+        """Test checking no headers, and headers with no errors."""
+        self.assertEqual(0, len(check_headers([]).files))
+        self.assertEqual(0, len(check_headers([self.headers[0]]).files))
+
+    def test_max_lines(self):
+        """Test that headers are cut down to the header window."""
+        options = mock.Mock(spec=())
+        options.author_re = '^Joe$'
+        options.ownership_max_lines = 1
+        Checker.parse_options(options)
+        self.assert_same([b':author: Joe\n', b'\n:author: Joe\n'])
+
+    def test_policies(self):
+        """Test that each file is checked against its policy."""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'policies.ini')
+        with open(path, 'w') as f:
+            f.write('[vendor]\nlicense-re = ^MIT$\n')
+        options = mock.Mock(spec=())
+        options.license_re = '^BSD$'
+        options.ownership_policies = path
+        Checker.parse_options(options)
+        headers = [b':license: MIT\n'] * 2
+        paths = [os.path.join(directory, name, 'module.py')
+                 for name in ('vendor', 'src')]
+        batch = self.assert_same(headers, paths)
+        self.assertEqual([1], list(batch.files))
+
+    def test_comment_prefixes(self):
+        """Test that each header is scanned with its file's profile."""
+        options = mock.Mock(spec=())
+        options.license_re = '^BSD$'
+        options.ownership_comment_prefixes = '.sh=#, .js=//'
+        Checker.parse_options(options)
+        headers = [
+            b'#!/bin/sh\n# :license: BSD\n',
+            b'#!/bin/sh\n:license: BSD\n',
+            b'// :license: GPL\n#:license: BSD\n',
+            b'#:license: BSD\n:license: BSD\n',
+        ]
+        paths = ['a.sh', 'b.sh', 'c.js', 'd.py']
+        batch = self.assert_same(headers, paths)
+        self.assertEqual([1, 2], list(batch.files))
+
+
+class ScannerTestCase(unittest.TestCase):
+    """Base class for tests of the standalone scanner."""
+
+    def setUp(self):
+        """Create a temporary directory with a config and source files."""
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.addCleanup(Checker.parse_options, mock.Mock(spec=()))
+        self.config = self.path('setup.cfg')
+        self.write('setup.cfg', '[flake8]\nlicense-re = ^BSD$\n')
+        self.write('good.py', '"""\n:license: BSD\n"""\n')
+        self.write('pkg/bad.py', '"""\n:license: GPL\n"""\n')
+        self.write('pkg/missing.py', '"""Nothing here."""\n')
+        self.write('pkg/data.txt', 'Not Python.\n')
+        self.write('.tox/ignored.py', '"""Excluded by default."""\n')
+
+    def path(self, *parts):
+        """
+        Return the path to ``parts`` in the temporary directory.
+
+        :param parts: Path components.
+        :return: Absolute path.
+        :rtype: :class:`str`
+        """
+        return os.path.join(self.dir, *parts)
+
+    def write(self, name, content):
+        """
+        Write ``content`` to the file ``name`` in the temporary directory.
+
+        :param str name: Slash-separated path relative to the directory.
+        :param str content: Content of the file.
+        """
+        path = self.path(*name.split('/'))
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as f:
+            f.write(content)
+
+    def main(self, *argv):
+        """
+        Run :func:`flake8_ownership.main` and capture its output.
+
+        :param argv: Arguments for the scanner.
+        :return: ``(status, lines)`` tuple.
+        :rtype: :class:`tuple`
+        """
+        with mock.patch('flake8_ownership.sys.stdout') as stdout:
+            status = main(['--config', self.config] + list(argv))
+        output = ''.join(call[0][0] for call in stdout.write.call_args_list)
+        return status, output.splitlines()
+
+
+class MainTest(ScannerTestCase):
+    """Test the standalone scanner."""
+
+    def test_errors(self):
+        """Test that errors are printed in flake8's format."""
+        status, lines = self.main('--jobs', '1', self.dir)
+        self.assertEqual(1, status)
+        self.assertEqual([
+            '%s:2:1: O102 unrecognized license' % self.path('pkg', 'bad.py'),
+            '%s:0:1: O102 missing license' % self.path('pkg', 'missing.py'),
+        ], lines)
+
+    def test_comment_prefixes(self):
+        """Test that other types of files are found and checked too."""
+        self.write(
+            'setup.cfg',
+            '[flake8]\nlicense-re = ^BSD$\n'
+            'ownership-comment-prefixes = .sh .yml=#\n',
+        )
+        self.write('tools/run.sh', '#!/bin/sh\n# :license: GPL\n')
+        self.write('tools/ok.sh', '#!/bin/sh\n# :license: BSD\n')
+        self.write('ci.yml', 'x: 1\n')
+        status, lines = self.main('--jobs', '2', self.dir)
+        self.assertEqual(1, status)
+        self.assertEqual([
+            '%s:0:1: O102 missing license' % self.path('ci.yml'),
+            '%s:2:1: O102 unrecognized license' % self.path('pkg', 'bad.py'),
+            '%s:0:1: O102 missing license' % self.path('pkg', 'missing.py'),
+            '%s:2:1: O102 unrecognized license' %
+            self.path('tools', 'run.sh'),
+        ], lines)
+
+    def test_option_error(self):
+        """Test that invalid options are reported as a usage error."""
+        self.write(
+            'setup.cfg',
+            '[flake8]\nlicense-re = ^(a+)+$\n'
+            'ownership-reject-nested-repeats = true\n',
+        )
+        with mock.patch('argparse._sys.stderr') as stderr:
+            with self.assertRaises(SystemExit) as raised:
+                self.main(self.dir)
+        self.assertEqual(2, raised.exception.code)
+        output = ''.join(call[0][0] for call in stderr.write.call_args_list)
+        self.assertIn('license-re', output)
+
+    @unittest.skipUnless(hasattr(os, 'symlink'), 'needs symlinks')
+    def test_unreadable(self):
+        """Test that a file that cannot be read does not stop the scan."""
+        os.symlink(self.path('nowhere.py'), self.path('pkg', 'dangling.py'))
+        for argv in (['--jobs', '1'], ['--jobs', '2'], ['--concurrency', '2']):
+            status, lines = self.main(*(argv + [self.dir]))
+            self.assertEqual(1, status)
+            self.assertEqual(3, len(lines), argv)
+            prefix = '%s:0:1: E902 ' % self.path('pkg', 'dangling.py')
+            self.assertTrue(lines[1].startswith(prefix), lines[1])
+            self.assertIn('No such file', lines[1])
+
+    @unittest.skipUnless(hasattr(os, 'symlink'), 'needs symlinks')
+    def test_unreadable_report(self):
+        """Test that ``--report`` skips a file that cannot be read."""
+        os.symlink(self.path('nowhere.py'), self.path('pkg', 'dangling.py'))
+        for jobs in ('1', '2'):
+            with mock.patch('flake8_ownership.sys.stderr') as stderr:
+                status, lines = self.main(
+                    '--jobs',
+                    jobs,
+                    '--report',
+                    'table',
+                    self.dir,
+                )
+            self.assertEqual(1, status)
+            self.assertEqual('3 files', lines[0])
+            output = ''.join(c[0][0] for c in stderr.write.call_args_list)
+            prefix = '%s:0:1: E902 ' % self.path('pkg', 'dangling.py')
+            self.assertTrue(output.startswith(prefix), output)
+
+    def test_jobs(self):
+        """Test that a process pool produces the same results."""
+        expected = self.main('--jobs', '1', self.dir)
+        self.assertEqual(expected, self.main('--jobs', '2', self.dir))
+
+    def test_format_jsonl(self):
+        """Test that ``--format jsonl`` writes a JSON record per error."""
+        status, lines = self.main('--jobs', '1', '--format', 'jsonl', self.dir)
+        self.assertEqual(1, status)
+        self.assertEqual([
+            dict(
+                code='O102',
+                column=1,
+                line=2,
+                message='O102 unrecognized license',
+                option='license_re',
+                path=self.path('pkg', 'bad.py'),
+                tag='license',
+                value='GPL',
+            ),
+            dict(
+                code='O102',
+                column=1,
+                line=0,
+                message='O102 missing license',
+                option='license_re',
+                path=self.path('pkg', 'missing.py'),
+                tag='license',
+                value=None,
+            ),
+        ], [json.loads(line) for line in lines])
+
+    def test_format_sarif_timeout(self):
+        """Test that the timeout rule is listed when there is a timeout."""
+        self.write(
+            'setup.cfg',
+            '[flake8]\nlicense-re = ^BSD$\nownership-match-timeout = 1\n',
+        )
+        _, lines = self.main('--jobs', '1', '--format', 'sarif', self.dir)
+        driver = json.loads('\n'.join(lines))['runs'][0]['tool']['driver']
+        self.assertEqual(
+            ['O102', 'O103'],
+            [rule['id'] for rule in driver['rules']],
+        )
+
+    def test_format_sarif(self):
+        """Test that ``--format sarif`` writes a SARIF log."""
+        status, lines = self.main('--jobs', '1', '--format', 'sarif', self.dir)
+        self.assertEqual(1, status)
+        log = json.loads('\n'.join(lines))
+        self.assertEqual('2.1.0', log['version'])
+        run = log['runs'][0]
+        self.assertEqual(
+            ['O102'],
+            [rule['id'] for rule in run['tool']['driver']['rules']],
+        )
+        bad, missing = run['results']
+        self.assertEqual('O102', bad['ruleId'])
+        self.assertEqual('O102 unrecognized license', bad['message']['text'])
+        location = bad['locations'][0]['physicalLocation']
+        self.assertEqual(
+            'file://' + self.path('pkg', 'bad.py').replace(os.sep, '/'),
+            location['artifactLocation']['uri'],
+        )
+        self.assertEqual(2, location['region']['startLine'])
+        self.assertEqual('GPL', bad['properties']['value'])
+        location = missing['locations'][0]['physicalLocation']
+        self.assertNotIn('region', location)
+        self.assertIsNone(missing['properties']['value'])
+
+    def test_format_sarif_empty(self):
+        """Test that the SARIF log is valid when there are no errors."""
+        status, lines = self.main(
+            '--format',
+            'sarif',
+            self.path('good.py'),
+        )
+        self.assertEqual(0, status)
+        log = json.loads('\n'.join(lines))
+        self.assertEqual([], log['runs'][0]['results'])
+
+    @unittest.skipIf(asyncio is None, 'asyncio is not available')
+    def test_concurrency(self):
+        """Test that the asyncio engine produces the same results."""
+        expected = self.main('--jobs', '1', self.dir)
+        self.assertEqual(expected, self.main('--concurrency', '4', self.dir))
+
+    @unittest.skipIf(asyncio is None, 'asyncio is not available')
+    def test_scan(self):
+        """Test that reads overlap up to the limit and results stay ordered."""
+        # Parse the options from the config (there are no files to check).
+        main(['--config', self.config, '--jobs', '1', os.devnull])
+        lock = threading.Lock()
+        state = dict(current=0, peak=0)
+        paths = ['%i.py' % i for i in range(12)]
+
+        def read(path):
+            with lock:
+                state['current'] += 1
+                state['peak'] = max(state['peak'], state['current'])
+            # Later files finish first.
+            time.sleep(0.002 * (12 - int(path[:-3])))
+            with lock:
+                state['current'] -= 1
+            if path == '3.py':
+                return b'"""\n:license: GPL\n"""\n'
+            return b'"""\n:license: BSD\n"""\n'
+
+        results = list(scan(paths, 4, read))
+        self.assertEqual(paths, [path for path, _, _ in results])
+        self.assertEqual(
+            [('3.py', [(2, 0, 'O102 unrecognized license')], {
+                'license': 'GPL',
+            })],
+            [result for result in results if result[1]],
+        )
+        self.assertEqual(4, state['peak'])
+
+    def test_report(self):
+        """Test that ``--report`` counts the values of each tag."""
+        self.write('other.py', '"""\n:license: BSD\n"""\n')
+        status, lines = self.main('--jobs', '2', '--report', 'json', self.dir)
+        self.assertEqual(0, status)
+        self.assertEqual(dict(files=4, tags=dict(license=[
+            dict(files=2, unrecognized=0, value='BSD'),
+            dict(files=1, unrecognized=1, value='GPL'),
+            dict(files=1, unrecognized=0, value=None),
+        ])), json.loads('\n'.join(lines)))
+
+        status, lines = self.main('--jobs', '1', '--report', 'table', self.dir)
+        self.assertEqual((0, [
+            '4 files',
+            '',
+            'license',
+            '    files  unrecognized  value',
+            '        2             0  BSD',
+            '        1             1  GPL',
+            '        1             -  (missing)',
+        ]), (status, lines))
+
+    def test_report_timeout(self):
+        """Test that ``--report`` is held to the match timeout too."""
+        self.write(
+            'setup.cfg',
+            '[flake8]\nlicense-re = ^(a+)+$\nownership-match-timeout = 0.1\n',
+        )
+        self.write('slow.py', '"""\n:license: %s\n"""\n' % ('a' * 64 + '!'))
+        start = time.time()
+        with mock.patch('flake8_ownership.sys.stderr'):
+            status, lines = self.main(
+                '--jobs',
+                '1',
+                '--report',
+                'json',
+                self.path('slow.py'),
+            )
+        self.assertLess(time.time() - start, 5)
+        self.assertEqual(dict(files=1, tags=dict(license=[
+            dict(files=1, unrecognized=1, value='a' * 64 + '!'),
+        ])), json.loads('\n'.join(lines)))
+
+    def test_policies(self):
+        """Test that the policy file is relative to the config file."""
+        self.write('policies.ini', '[pkg]\nlicense-re = ^GPL$\n')
+        self.write('setup.cfg', '[flake8]\nlicense-re = ^BSD$\n'
+                                'ownership-policies = policies.ini\n')
+        status, lines = self.main('--jobs', '1', self.dir)
+        self.assertEqual(1, status)
+        self.assertEqual(
+            ['%s:0:1: O102 missing license' % self.path('pkg', 'missing.py')],
+            lines,
+        )
+
+    def test_command_line_overrides_config(self):
+        """Test that command line options take precedence over config."""
+        status, lines = self.main(
+            '--jobs',
+            '1',
+            '--license-re',
+            '^(BSD|GPL)$',
+            self.path('good.py'),
+            self.path('pkg', 'bad.py'),
+        )
+        self.assertEqual((0, []), (status, lines))
+
+
+@unittest.skipIf(not has_git, 'git is not installed')
+class DiffBaseTest(ScannerTestCase):
+    """Test the standalone scanner's ``--diff-base`` mode."""
+
+    def setUp(self):
+        """Commit the source files to a git repository and change some."""
+        super(DiffBaseTest, self).setUp()
+        body = '"""Nothing here."""\n' + '\n' * 9 + 'x = %i\n'
+        self.write('pkg/missing.py', body % 1)
+        self.git('init', '-q')
+        self.git('add', '.')
+        self.git('commit', '-q', '-m', 'Initial commit.')
+        cwd = os.getcwd()
+        os.chdir(self.dir)
+        self.addCleanup(os.chdir, cwd)
+
+        self.write('good.py', '"""\n:license: GPL\n"""\n')
+        self.write('pkg/missing.py', body % 2)
+        self.write('pkg/new.py', '"""Nothing here either."""\n')
+        self.git('add', 'pkg/new.py')
+
+    def git(self, *args):
+        """
+        Run git in the temporary directory.
+
+        :param args: Arguments for git.
+        """
+        subprocess.check_call(
+            [
+                'git',
+                '-c',
+                'user.name=Test',
+                '-c',
+                'user.email=test@example.com',
+            ] + list(args),
+            cwd=self.dir,
+        )
+
+    def test_changed(self):
+        """Test that only changed files are checked."""
+        status, lines = self.main('--jobs', '1', '--diff-base', 'HEAD')
+        self.assertEqual(1, status)
+        self.assertEqual([
+            'good.py:2:1: O102 unrecognized license',
+            os.path.join('pkg', 'missing.py') + ':0:1: O102 missing license',
+            os.path.join('pkg', 'new.py') + ':0:1: O102 missing license',
+        ], sorted(lines))
+
+    def test_header(self):
+        """Test that changes past the header are skipped."""
+        status, lines = self.main(
+            '--jobs',
+            '1',
+            '--diff-base',
+            'HEAD',
+            '--ownership-max-lines',
+            '5',
+            'good.py',
+            'pkg',
+        )
+        self.assertEqual(1, status)
+        self.assertEqual([
+            'good.py:2:1: O102 unrecognized license',
+            os.path.join('pkg', 'new.py') + ':0:1: O102 missing license',
+        ], sorted(lines))
+
+
+class FixTest(ScannerTestCase):
+    """Test the standalone scanner's ``--fix`` mode."""
+
+    def setUp(self):
+        """Configure a copyright regex with ``<YEAR>`` and stale files."""
+        super(FixTest, self).setUp()
+        self.year = datetime.datetime.today().year
+        self.write(
+            'setup.cfg',
+            '[flake8]\ncopyright-re = ^Copyright Joe<COMMA> 2016-<YEAR>$\n',
+        )
+        self.write(
+            'range.py',
+            '"""\n:copyright: Copyright Joe, 2016-2017\n"""\nx = 1\n',
+        )
+        self.write('single.py', '"""\n:copyright: Copyright Joe, 2016\n"""\n')
+        self.write('other.py', '"""\n:copyright: Copyright Bob, 2016\n"""\n')
+        self.fixed = '"""\n:copyright: Copyright Joe, 2016-%i\n"""\n' % \
+            self.year
+
+    def read(self, name):
+        """
+        Return the content of the file ``name`` in the temporary directory.
+
+        :param str name: Slash-separated path relative to the directory.
+        :rtype: :class:`str`
+        """
+        with open(self.path(*name.split('/'))) as f:
+            return f.read()
+
+    def test_fix(self):
+        """Test that stale copyright lines are rewritten in place."""
+        os.chmod(self.path('range.py'), 0o755)
+        status, lines = self.main('--jobs', '2', '--fix', self.dir)
+        self.assertEqual(0, status)
+        self.assertEqual([
+            '%s:2: fixed copyright' % self.path('range.py'),
+            '%s:2: fixed copyright' % self.path('single.py'),
+        ], lines)
+        self.assertEqual(self.fixed + 'x = 1\n', self.read('range.py'))
+        self.assertEqual(self.fixed, self.read('single.py'))
+        self.assertEqual(
+            '"""\n:copyright: Copyright Bob, 2016\n"""\n',
+            self.read('other.py'),
+        )
+        self.assertEqual(0o755, os.stat(self.path('range.py')).st_mode & 0o777)
+        self.assertEqual(
+            ['%s:2:1: O101 unrecognized copyright' % self.path('other.py')],
+            [line for line in self.main('--jobs', '1', self.dir)[1]
+             if 'unrecognized copyright' in line],
+        )
+        self.assertEqual((0, []), self.main('--fix', '--jobs', '1', self.dir))
+
+    def test_fix_comment_prefix(self):
+        """Test fixing a copyright line after a comment prefix."""
+        self.write(
+            'setup.cfg',
+            '[flake8]\ncopyright-re = ^Copyright Joe<COMMA> 2016-<YEAR>$\n'
+            'ownership-comment-prefixes = .sh=#\n',
+        )
+        self.write('run.sh', '#!/bin/sh\n# :copyright: Copyright Joe, 2016\n')
+        self.main('--fix', '--jobs', '1', self.dir)
+        self.assertEqual(
+            '#!/bin/sh\n# :copyright: Copyright Joe, 2016-%i\n' % self.year,
+            self.read('run.sh'),
+        )
+
+    def test_diff(self):
+        """Test that ``--diff`` prints the changes without making them."""
+        path = self.path('single.py')
+        status, lines = self.main('--jobs', '1', '--diff', path)
+        self.assertEqual(1, status)
+        self.assertEqual([
+            '--- %s' % path,
+            '+++ %s' % path,
+            '@@ -2 +2 @@',
+            '-:copyright: Copyright Joe, 2016',
+            '+:copyright: Copyright Joe, 2016-%i' % self.year,
+        ], lines)
+        self.assertEqual(
+            '"""\n:copyright: Copyright Joe, 2016\n"""\n',
+            self.read('single.py'),
+        )
+
+    def test_timeout(self):
+        """Test that a copyright that takes too long to match is left alone."""
+        self.write(
+            'setup.cfg',
+            '[flake8]\ncopyright-re = ^(a+)+<COMMA> <YEAR>$\n'
+            'ownership-match-timeout = 0.1\n',
+        )
+        content = '"""\n:copyright: %s, 2016\n"""\n' % ('a' * 64 + '!')
+        self.write('slow.py', content)
+        start = time.time()
+        with mock.patch('flake8_ownership.sys.stderr'):
+            status, lines = self.main(
+                '--jobs',
+                '1',
+                '--fix',
+                self.path('slow.py'),
+            )
+        self.assertLess(time.time() - start, 5)
+        self.assertEqual((0, []), (status, lines))
+        self.assertEqual(content, self.read('slow.py'))
+
+    @unittest.skipUnless(hasattr(os, 'symlink'), 'needs symlinks')
+    def test_unreadable(self):
+        """Test that a file that cannot be read does not stop the fixes."""
+        os.symlink(self.path('nowhere.py'), self.path('dangling.py'))
+        for argv in (['--diff', '--jobs', '1'], ['--fix', '--jobs', '2']):
+            with mock.patch('flake8_ownership.sys.stderr') as stderr:
+                status, lines = self.main(*(argv + [self.dir]))
+            self.assertEqual(1, status)
+            self.assertTrue(any('single.py' in line for line in lines), lines)
+            output = ''.join(c[0][0] for c in stderr.write.call_args_list)
+            prefix = '%s:0:1: E902 ' % self.path('dangling.py')
+            self.assertTrue(output.startswith(prefix), output)
+        self.assertEqual(self.fixed, self.read('single.py'))
+
+
+@unittest.skipUnless(hasattr(socket, 'AF_UNIX'), 'needs Unix sockets')
+class DaemonTest(ScannerTestCase):
+    """Test the watch daemon, with a stand-in for an editor as the client."""
+
+    def setUp(self):
+        """Start a daemon serving the temporary directory."""
+        super(DaemonTest, self).setUp()
+        options = mock.Mock(spec=())
+        options.license_re = '^BSD$'
+        Checker.parse_options(options)
+        self.index = HeaderIndex([self.dir])
+        self.daemon = Daemon(self.path('daemon.sock'), self.index, 0.05)
+        thread = threading.Thread(target=self.daemon.serve_forever)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(self.daemon.shutdown)
+        self.assertTrue(self.daemon.ready.wait(10))
+
+    def query(self, *requests):
+        """
+        Send ``requests`` over one connection and return the responses.
+
+        :param requests: Requests, as :class:`dict` or :class:`str`.
+        :return: List of responses.
+        :rtype: :class:`list` of :class:`dict`
+        """
+        client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.addCleanup(client.close)
+        client.connect(self.daemon.address)
+        stream = client.makefile('rwb')
+        self.addCleanup(stream.close)
+        rv = []
+        for request in requests:
+            if not isinstance(request, str):
+                request = json.dumps(request)
+            stream.write(request.encode('utf-8') + b'\n')
+            stream.flush()
+            rv.append(json.loads(stream.readline().decode('utf-8')))
+        return rv
+
+    def messages(self, response):
+        """Return the error messages in ``response``."""
+        return [error['message'] for error in response['errors']]
+
+    def test_query(self):
+        """Test that queries are answered from the index."""
+        self.assertEqual(3, len(self.index.entries))
+        good, bad, missing = self.query(
+            dict(path=self.path('good.py')),
+            dict(path=self.path('pkg', 'bad.py')),
+            dict(path=self.path('pkg', 'missing.py')),
+        )
+        self.assertEqual([], good['errors'])
+        self.assertEqual(self.path('pkg', 'bad.py'), bad['path'])
+        self.assertEqual(['O102 unrecognized license'], self.messages(bad))
+        self.assertEqual('GPL', bad['errors'][0]['value'])
+        self.assertEqual(['O102 missing license'], self.messages(missing))
+
+    def test_errors(self):
+        """Test the responses to bad requests."""
+        nothing, garbage, unknown, number, array, content, nul = self.query(
+            dict(path=self.path('nothing.py')),
+            'not json',
+            dict(file='good.py'),
+            dict(path=1),
+            [self.path('good.py')],
+            dict(path=self.path('good.py'), content=['x']),
+            dict(path=self.path('good.py') + '\0'),
+        )
+        self.assertTrue(nothing['error'].startswith('no such file'))
+        for response in (garbage, unknown, number, array, content, nul):
+            self.assertTrue(response['error'].startswith('bad request'))
+        # The daemon is still answering.
+        good, = self.query(dict(path=self.path('good.py')))
+        self.assertEqual([], good['errors'])
+
+    def test_socket_permissions(self):
+        """Test that only the daemon's user can connect to it."""
+        mode = os.stat(self.daemon.address).st_mode
+        self.assertEqual(0, mode & 0o077)
+
+    def test_content(self):
+        """Test that unsaved content is checked without touching the index."""
+        path = self.path('good.py')
+        unsaved, saved = self.query(
+            dict(path=path, content='"""\n:license: MIT\n"""\n'),
+            dict(path=path),
+        )
+        self.assertEqual(['O102 unrecognized license'], self.messages(unsaved))
+        self.assertEqual([], saved['errors'])
+
+    def test_changes(self):
+        """Test that changes to files are picked up."""
+        self.write('pkg/bad.py', '"""\n:license: BSD\n"""\n')
+        self.write('pkg/new.py', '"""\n:license: GPL\n"""\n')
+        # A query notices the change even if the watcher has not yet.
+        fixed, new = self.query(
+            dict(path=self.path('pkg', 'bad.py')),
+            dict(path=self.path('pkg', 'new.py')),
+        )
+        self.assertEqual([], fixed['errors'])
+        self.assertEqual(['O102 unrecognized license'], self.messages(new))
+
+        self.write('pkg/watched.py', '"""\n:license: BSD\n"""\n')
+        os.remove(self.path('good.py'))
+        deadline = time.time() + 10
+        while time.time() < deadline:
+            entries = self.index.entries
+            if self.path('pkg', 'watched.py') in entries and \
+                    self.path('good.py') not in entries:
+                break
+            time.sleep(0.01)
+        else:
+            self.fail('watcher did not pick up the changes')
+
+    def test_new_directory(self):
+        """Test that exclusions apply in a directory moved in."""
+        outside = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, outside, True)
+        for name in ('new.py', '.tox/ignored.py', '__pycache__/x.py'):
+            path = os.path.join(outside, 'new', *name.split('/'))
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, 'w') as f:
+                f.write('"""\n:license: GPL\n"""\n')
+        os.rename(os.path.join(outside, 'new'), self.path('new'))
+        deadline = time.time() + 10
+        while self.path('new', 'new.py') not in self.index.entries:
+            if time.time() > deadline:
+                self.fail('watcher did not pick up the directory')
+            time.sleep(0.01)
+        self.assertEqual(
+            [self.path('new', 'new.py')],
+            [path for path in self.index.entries
+             if path.startswith(self.path('new'))],
+        )
+
+    def test_poll(self):
+        """Test updating the index by polling."""
+        index = HeaderIndex([self.dir])
+        index.build()
+        self.write('good.py', '"""\n:license: GPL\n"""\n')
+        os.remove(self.path('pkg', 'missing.py'))
+        index.poll()
+        self.assertEqual(
+            [self.path('good.py'), self.path('pkg', 'bad.py')],
+            sorted(index.entries),
+        )
+        errors, _ = index.query(self.path('good.py'))
+        self.assertEqual([(2, 0, 'O102 unrecognized license')], errors)